@@ -0,0 +1,79 @@
+# Compare the in-process Cost Explorer client against spawning the aws cli
+# Both talk to a local stub so this runs offline
+# Run from the repo root: python3 -m bench.aws_startup [--calls N] [--out results.json]
+import sys
+import json
+import time
+import shutil
+import argparse
+
+from bench.stub import StubServer
+from providers import amazon
+from providers.common import aws
+
+# Cost Explorer answers every action on / with the target in a header
+def get_cost_and_usage(request):
+    if 'AWS4-HMAC-SHA256' not in request.headers.get('Authorization', ''):
+        return 403, {'__type': 'MissingAuthenticationTokenException', 'message': 'Missing Authentication Token'}
+    period = request.json()['TimePeriod']
+    return 200, {
+        'ResultsByTime': [{
+            'TimePeriod': period,
+            'Total': {'BlendedCost': {'Amount': '123.4567', 'Unit': 'USD'}},
+            'Groups': [],
+            'Estimated': True,
+        }],
+        'DimensionValueAttributes': [],
+    }
+
+routes = [
+    ('POST', '/', get_cost_and_usage),
+]
+
+# Time each call, returns the timings in seconds
+def timed(func, calls) -> list:
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def summary(timings) -> dict:
+    return {
+        'calls': len(timings),
+        'first': timings[0],
+        'mean': sum(timings) / len(timings),
+        'min': min(timings),
+        'max': max(timings),
+    }
+
+def main(args):
+    results = {}
+    with StubServer(routes) as stub:
+        aws.ce_endpoint = f'{stub.url}/'
+        results['in_process'] = summary(timed(lambda: amazon.cost('bench', 'AKIDEXAMPLE', 'secret'), args.calls))
+
+        cli = shutil.which(amazon.aws_cli) or shutil.which('aws')
+        if cli:
+            amazon.aws_cli = cli
+            results['subprocess'] = summary(timed(
+                lambda: amazon.get_cost_and_usage_cli('2021-01-01', '2021-02-01', 'AKIDEXAMPLE', 'secret', f'{stub.url}/'),
+                args.calls))
+        else:
+            print('aws cli not found, skipping the subprocess path', file=sys.stderr)
+
+    if 'subprocess' in results:
+        results['speedup'] = results['subprocess']['mean'] / results['in_process']['mean']
+
+    out = json.dumps(results, indent=4)
+    print(out)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(out)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=20, help='calls to make per path')
+    parser.add_argument('--out', type=str, required=False, help='also write the results to this json file')
+    main(parser.parse_args())
@@ -0,0 +1,111 @@
+# Compare streaming/prefetching Azure usageDetails pagination against loading every page in full
+# Pages are synthetic and served by a local stub, so this runs offline
+# Run from the repo root: python3 -m bench.azure_usage [--pages N] [--items N] [--out results.json]
+import gc
+import json
+import time
+import random
+import argparse
+import tracemalloc
+
+from bench.stub import StubServer
+from providers import azure
+from providers.common import tokens
+
+usage_path = '/subscriptions/{subscriptionId}/providers/Microsoft.Consumption/usageDetails'
+
+# A usage item roughly the size of the real thing with $expand=properties/meterDetails
+def usage_item(i) -> dict:
+    return {
+        'id': f'/subscriptions/bench/providers/Microsoft.Billing/billingPeriods/202110/providers/Microsoft.Consumption/usageDetails/{i:032x}',
+        'name': f'{i:032x}',
+        'type': 'Microsoft.Consumption/usageDetails',
+        'kind': 'legacy',
+        'tags': {'env': 'bench', 'owner': 'cloudcost'},
+        'properties': {
+            'billingAccountId': '12345678',
+            'billingPeriodStartDate': '2021-10-01T00:00:00.0000000Z',
+            'billingPeriodEndDate': '2021-10-31T00:00:00.0000000Z',
+            'servicePeriodStartDate': '2021-10-01T00:00:00.0000000Z',
+            'servicePeriodEndDate': '2021-10-31T00:00:00.0000000Z',
+            'date': '2021-10-15T00:00:00.0000000Z',
+            'resourceId': f'/subscriptions/bench/resourceGroups/rg/providers/Microsoft.Compute/virtualMachines/vm{i % 500}',
+            'resourceLocation': 'EastUS',
+            'consumedService': 'Microsoft.Compute',
+            'quantity': random.random() * 24,
+            'effectivePrice': random.random(),
+            'cost': random.random(),
+            'costInUSD': round(random.random() * 10, 6),
+            'meterDetails': {
+                'meterName': 'D2 v3/D2s v3',
+                'meterCategory': 'Virtual Machines',
+                'meterSubCategory': 'Dv3/DSv3 Series',
+                'unitOfMeasure': '1 Hour',
+                'serviceFamily': 'Compute',
+            },
+        },
+    }
+
+# Render every page up front so serving them costs nothing
+def make_pages(url, pages, items) -> list:
+    bodies = []
+    for page in range(pages):
+        js = {'value': [usage_item(page * items + i) for i in range(items)]}
+        if page + 1 < pages:
+            js['nextLink'] = f'{url}{usage_path.format(subscriptionId="bench")}?api-version=2021-10-01&$skiptoken={page + 1}'
+        bodies.append(json.dumps(js).encode('utf-8'))
+    return bodies
+
+def run(stream) -> dict:
+    azure.stream_pages = stream
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    costs = azure.cost('bench', 'secret', 'bench', 'client', 'tenant')
+    elapsed = time.perf_counter() - start
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': elapsed, 'peak_bytes': peak, 'total': costs[0].cost}
+
+def main(args):
+    random.seed(0)
+    pages = []
+
+    def token(request):
+        return 200, {'access_token': 'bench', 'expires_in': '3600'}
+
+    def usage(request):
+        page = int(request.query.get('$skiptoken', ['0'])[0])
+        return 200, pages[page]
+
+    routes = [
+        ('POST', r'/[^/]+/oauth2/token', token),
+        ('GET', usage_path.format(subscriptionId='[^/]+'), usage),
+    ]
+
+    results = {'pages': args.pages, 'items_per_page': args.items}
+    with StubServer(routes, latency=args.latency) as stub:
+        pages.extend(make_pages(stub.url, args.pages, args.items))
+        results['bytes'] = sum(len(p) for p in pages)
+        azure.auth_endpoint = f'{stub.url}/{{tenant_id}}/oauth2/token'
+        azure.usage_endpoint = f'{stub.url}{usage_path}'
+
+        results['full_pages'] = run(False)
+        tokens.cache.clear()
+        results['streaming'] = run(True)
+
+    results['same_total'] = results['full_pages']['total'] == results['streaming']['total']
+
+    out = json.dumps(results, indent=4)
+    print(out)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(out)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=10, help='number of usage pages')
+    parser.add_argument('--items', type=int, default=5000, help='usage items per page')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds the stub waits before answering')
+    parser.add_argument('--out', type=str, required=False, help='also write the results to this json file')
+    main(parser.parse_args())
@@ -0,0 +1,214 @@
+# Scale test, how run_cost, get_accounts() and the report writer hold up as the number of accounts grows
+# Synthetic accounts are spread over the providers bench.suite has stubs for, the stub can add latency,
+# jitter and errors. Every size is a point on the curves: throughput, per account latency
+# percentiles, peak memory, get_accounts() and report time
+# Run from the repo root: python3 -m bench.scale [--sizes 10,100,1000,10000] [--dsn ...] [--out scale.json]
+# With --dsn the accounts are seeded into that database and run_cost reads them through get_accounts(),
+# it must be a scratch database, we refuse to touch one holding accounts of its own
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import configparser
+import contextlib
+from datetime import datetime
+
+from bench.stub import StubServer
+from bench import suite
+from providers.base import CostItem
+
+# Prefix of every account we seed, so they're easy to clean up
+prefix = 'scale-'
+
+# Wrap a stub handler with random extra latency and errors
+def flaky(handler, jitter, error_rate):
+    def handle(request):
+        if jitter:
+            time.sleep(random.uniform(0, jitter))
+        if random.random() < error_rate:
+            return 500, {'error': 'injected failure'}
+        return handler(request)
+    return handle
+
+# n synthetic accounts, round robin over the providers, each with its own credentials
+def synthetic(n) -> list:
+    ret = []
+    for i in range(n):
+        (provider, _, cred) = suite.accounts[i % len(suite.accounts)]
+        cred = {k: (f'{v}{i}' if k in ('api_key', 'password') else v) for (k, v) in cred.items()}
+        ret.append((provider, f'{prefix}{i}', cred))
+    return ret
+
+def connect(dsn):
+    import psycopg2
+    import psycopg2.extras
+    conn = psycopg2.connect(dsn)
+    return conn, conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+
+# Load the schema if needed and replace our accounts with rows
+def seed(cur, rows):
+    import psycopg2.extras
+    cur.execute("select to_regclass('accounts') is not null;")
+    if not cur.fetchone()[0]:
+        with open(os.path.join(os.path.dirname(__file__), '..', 'schema.sql')) as f:
+            cur.execute(f.read())
+
+    cur.execute('select count(*) from accounts where name not like %s;', (f'{prefix}%',))
+    if cur.fetchone()[0]:
+        raise Exception('Database holds real accounts, point --dsn at a scratch database')
+
+    for provider in set(p for (p, _, _) in rows):
+        cur.execute('select create_iaas(%s) where get_iaas_id(%s) is null;', (provider, provider))
+    cur.execute('delete from accounts where name like %s;', (f'{prefix}%',))
+    psycopg2.extras.execute_values(cur,
+        'insert into accounts (iaas_id, name, cred, orderi) values %s;',
+        [(provider, name, json.dumps(cred), i) for (i, (provider, name, cred)) in enumerate(rows)],
+        template='(get_iaas_id(%s), %s, %s, %s)', page_size=1000)
+    cur.connection.commit()
+
+def percentile(values, p) -> float:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+# Time every cost_account() and acost_account() call of a run
+def instrument(cloudcost):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    (original, aoriginal) = (cloudcost.cost_account, cloudcost.acost_account)
+
+    @contextlib.contextmanager
+    def timing():
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            with lock:
+                errors[0] += 1
+            raise
+        finally:
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    def cost_account(*args, **kwargs):
+        with timing():
+            return original(*args, **kwargs)
+
+    async def acost_account(*args, **kwargs):
+        with timing():
+            return await aoriginal(*args, **kwargs)
+
+    def restore():
+        cloudcost.cost_account = original
+        cloudcost.acost_account = aoriginal
+
+    cloudcost.cost_account = cost_account
+    cloudcost.acost_account = acost_account
+    return latencies, errors, restore
+
+# Write a report of n accounts (two items each) on its own, returns seconds
+def report_time(n) -> float:
+    from report import open_report, row
+    cost = CostItem(123.456, '2021-10-01T00:00:00', '2021-10-31T00:00:00', '42.00 USD')
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        report = open_report('xlsx', os.path.join(tmp, 'scale.xlsx'))
+        for i in range(n * 2):
+            report.write(row('bench', f'{prefix}{i}', cost))
+        report.close()
+        return time.perf_counter() - start
+
+def point(n, args) -> dict:
+    import cloudcost
+    rows = synthetic(n)
+    ret = {'accounts': n}
+
+    if args.dsn:
+        (conn, cur) = connect(args.dsn)
+        seed(cur, rows)
+        start = time.perf_counter()
+        cur.execute('select iaas, name, cred, enable from get_accounts(null);')
+        cur.fetchall()
+        ret['get_accounts_seconds'] = time.perf_counter() - start
+    else:
+        (conn, cur) = (None, suite.Cursor(rows))
+
+    suite.fresh_store()
+    suite.forget()
+    (latencies, errors, restore) = instrument(cloudcost)
+    run = argparse.Namespace(nopost=True, iaas=None, account=None, workers=args.workers, max_age=0, refresh=False, format='xlsx',
+                             output=str(suite.workdir()))
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        # run_cost prints a line per account
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            cloudcost.run_cost(cur, args=run, conf=configparser.ConfigParser())
+    finally:
+        elapsed = time.perf_counter() - start
+        (_, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        restore()
+        if conn is not None:
+            conn.close()
+
+    ret.update({
+        'seconds': elapsed,
+        'throughput': n / elapsed,
+        'errors': errors[0],
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies) if latencies else None,
+        'peak_bytes': peak,
+        'report_seconds': report_time(n),
+    })
+    return ret
+
+def main(args):
+    random.seed(0)
+    results = {
+        'commit': suite.commit(),
+        'date': datetime.today().isoformat(),
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'error_rate': args.error_rate,
+        'payload': args.payload,
+        'workers': args.workers,
+        'points': [],
+    }
+
+    with StubServer([], latency=args.latency) as stub:
+        for make in (suite.azure_routes, suite.softlayer_routes, suite.rackspace_routes, suite.cloudsigma_routes, suite.jelastic_routes):
+            stub.add_routes([(m, p, flaky(h, args.jitter, args.error_rate)) for (m, p, h) in make(stub.url, args.payload)])
+        suite.point(stub.url)
+
+        print(f"{'accounts':>9} {'seconds':>9} {'acct/s':>8} {'p50':>7} {'p95':>7} {'p99':>7} {'errors':>7} {'peak MB':>8} {'report':>7}")
+        for n in args.sizes:
+            p = point(n, args)
+            results['points'].append(p)
+            print(f"{n:>9} {p['seconds']:>9.2f} {p['throughput']:>8.1f} {p['p50']:>7.3f} {p['p95']:>7.3f} {p['p99']:>7.3f} "
+                  f"{p['errors']:>7} {p['peak_bytes'] / 1e6:>8.1f} {p['report_seconds']:>7.2f}")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=4)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=lambda s: [int(n) for n in s.split(',')], default=[10, 100, 1000, 10000],
+                        help='comma separated account counts, one point each')
+    parser.add_argument('--dsn', type=str, required=False, help='scratch postgres database to seed the accounts into')
+    parser.add_argument('--workers', type=int, default=8, help='accounts queried at once')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds the stub waits before answering')
+    parser.add_argument('--jitter', type=float, default=0.02, help='up to this many more seconds at random')
+    parser.add_argument('--error-rate', type=float, default=0.01, help='fraction of requests answered with a 500')
+    parser.add_argument('--payload', type=float, default=0.05, help='size of the synthetic responses, 1 is bench.suite\'s')
+    parser.add_argument('--out', type=str, required=False, help='also write the curves to this json file')
+    main(parser.parse_args())
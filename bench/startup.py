@@ -0,0 +1,86 @@
+# CLI startup time, `--help` and `list` are called from shell scripts in tight loops so they have a budget
+# Runs each command under python -X importtime, reporting wall time, total import time and the slowest
+# top level imports, and fails if a command goes over budget or imports something it has no use for
+# list only reads, and needn't reach a database at all: everything it imports is loaded before it connects
+# Run from the repo root: python3 -m bench.startup [--runs N] [--budget 0.15] [--out startup.json]
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+# Heavy modules only some commands need, none of them belong in --help or list
+forbidden = ['requests', 'urllib3', 'openpyxl', 'ovh', 'dateutil', 'currency_converter', 'profiling', 'asyncio', 'aiohttp']
+
+commands = {
+    'help': ['--help'],
+    'list': ['list', 'providers'],
+    'implementations': ['list', 'implementations'],
+}
+
+# Parse -X importtime output into {module: (self us, cumulative us, depth)}
+def importtime(stderr) -> dict:
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        (own, cumulative, name) = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules[name.strip()] = (int(own), int(cumulative), depth)
+    return modules
+
+def run(argv) -> tuple:
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    # Without a configured host list fails fast rather than waiting on a connection
+    env = dict(os.environ, PGCONNECT_TIMEOUT='1', PGHOST='127.0.0.1', PGPORT='1')
+    start = time.perf_counter()
+    x = subprocess.run([sys.executable, '-X', 'importtime', 'cloudcost.py', *argv],
+                       cwd=root, env=env, capture_output=True, text=True)
+    return time.perf_counter() - start, importtime(x.stderr)
+
+def measure(argv, runs) -> dict:
+    timings = []
+    modules = {}
+    for _ in range(runs):
+        (elapsed, modules) = run(argv)
+        timings.append(elapsed)
+    top = sorted(((name, cumulative) for (name, (_, cumulative, depth)) in modules.items() if depth == 0),
+                 key=lambda m: -m[1])
+    return {
+        'seconds': min(timings),
+        'mean': sum(timings) / len(timings),
+        'import_seconds': sum(cumulative for (_, cumulative) in top) / 1e6,
+        'modules': len(modules),
+        'slowest': [{'module': name, 'seconds': cumulative / 1e6} for (name, cumulative) in top[:10]],
+        'forbidden': sorted(m for m in forbidden if m in modules),
+    }
+
+def main(args):
+    results = {'budget': args.budget, 'commands': {}}
+    failed = False
+    for (name, argv) in commands.items():
+        r = measure(argv, args.runs)
+        r['over_budget'] = r['seconds'] > args.budget
+        results['commands'][name] = r
+        failed = failed or r['over_budget'] or bool(r['forbidden'])
+
+    out = json.dumps(results, indent=4)
+    print(out)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(out)
+
+    for (name, r) in results['commands'].items():
+        if r['over_budget']:
+            print(f"{name} took {r['seconds']:.3f}s, over the {args.budget}s budget")
+        if r['forbidden']:
+            print(f"{name} imported {', '.join(r['forbidden'])}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5, help='runs per command, the fastest counts')
+    parser.add_argument('--budget', type=float, default=0.15, help='seconds each command may take to start')
+    parser.add_argument('--out', type=str, required=False, help='also write the results to this json file')
+    main(parser.parse_args())
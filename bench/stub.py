@@ -0,0 +1,104 @@
+import re
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+# Local stub HTTP server so providers can be exercised offline
+# Routes are (method, path regex, handler), the first match wins
+# handler(request) returns (status, body) or (status, body, headers)
+# body can be bytes, str, or anything json serializable
+
+# What a handler gets to look at
+class Request:
+    def __init__(self, method, path, query, headers, body, match):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+        self.match = match
+
+    def json(self):
+        return json.loads(self.body or b'null')
+
+class StubServer:
+    def __init__(self, routes, latency=0):
+        self.routes = [(m, re.compile(p), h) for (m, p, h) in routes]
+        # Seconds to sleep before answering, to look a bit more like the real thing
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+        self.server = None
+
+    def __enter__(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out in separate writes, don't let Nagle hold the body back
+            disable_nagle_algorithm = True
+
+            def handle_any(self):
+                parts = urlsplit(self.path)
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length) if length else b''
+                status, payload, headers = stub.dispatch(self.command, parts.path, parse_qs(parts.query), self.headers, body)
+                if stub.latency:
+                    time.sleep(stub.latency)
+                # Counted before answering, a client may otherwise be done before we count its last request
+                with stub.lock:
+                    stub.requests += 1
+                    stub.bytes += len(payload)
+                self.send_response(status)
+                for (k, v) in headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = do_DELETE = handle_any
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    # Routes added once the server is up, for responses that need to know its url
+    def add_routes(self, routes):
+        self.routes.extend((m, re.compile(p), h) for (m, p, h) in routes)
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes = 0
+
+    def dispatch(self, method, path, query, headers, body):
+        for (m, pattern, handler) in self.routes:
+            match = pattern.fullmatch(path)
+            if m == method and match:
+                ret = handler(Request(method, path, query, headers, body, match))
+                break
+        else:
+            ret = (404, {'error': f'no stub for {method} {path}'})
+
+        (status, payload, headers) = (ret + ({},))[:3]
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        elif not isinstance(payload, bytes):
+            payload = json.dumps(payload).encode('utf-8')
+            headers = {'Content-Type': 'application/json', **headers}
+        return status, payload, headers
@@ -0,0 +1,255 @@
+# Offline benchmark suite, every provider we have synthetic data for plus run_cost end to end
+# Providers run against a local stub, reporting wall time, requests, bytes served and peak memory
+# Each provider is run cold (empty store) then warm (store kept from the cold run, as the next night would)
+# Run from the repo root: python3 -m bench.suite [--scale N] [--out results.json] [--compare old.json]
+import gc
+import csv
+import atexit
+import io
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+import configparser
+from pathlib import Path
+from datetime import datetime
+
+from bench.stub import StubServer
+from bench import azure_usage
+from providers import azure, rackspace, cloudsigma, softlayer, cloudjiffy
+from providers.common import softlayer as sl
+from providers.common import store, tokens, archive
+
+# Synthetic data, sizes scale with --scale
+def size(n, scale) -> int:
+    return max(1, int(n * scale))
+
+def azure_routes(url, scale) -> list:
+    pages = azure_usage.make_pages(f'{url}/azure', size(2, scale), size(2000, scale))
+    return [
+        ('POST', r'/azure/[^/]+/oauth2/token', lambda r: (200, {'access_token': 'bench', 'expires_in': '3600'})),
+        ('GET', r'/azure/subscriptions/[^/]+/providers/Microsoft.Consumption/usageDetails',
+            lambda r: (200, pages[int(r.query.get('$skiptoken', ['0'])[0])])),
+    ]
+
+def softlayer_item(i, children) -> dict:
+    return {
+        'id': i,
+        'billingItemId': i,
+        'categoryCode': 'paas_bench' if i % 4 == 0 else 'guest_core',
+        'recurringFee': f'{random.random() * 10:.3f}',
+        'cycleStartDate': '2021-10-01T00:00:00-06:00',
+        'nextBillDate': '2021-11-01T00:00:00-06:00',
+        children: [{'recurringFee': f'{random.random():.3f}'} for _ in range(i % 6)],
+    }
+
+def softlayer_routes(url, scale) -> list:
+    nxt = [softlayer_item(i, 'nonZeroNextInvoiceChildren') for i in range(size(500, scale))]
+    prev = [softlayer_item(i, 'nonZeroAssociatedChildren') for i in range(size(500, scale))]
+    base = '/softlayer/rest/v3.1'
+    return [
+        ('GET', f'{base}/SoftLayer_Account/getNextInvoiceTopLevelBillingItems.json', lambda r: (200, nxt)),
+        ('GET', f'{base}/SoftLayer_Account/getLatestRecurringInvoice.json',
+            lambda r: (200, {'id': 1, 'createDate': '2021-10-01T00:00:00-06:00'})),
+        ('GET', f'{base}/SoftLayer_Billing_Invoice/1/getInvoiceTopLevelItems.json', lambda r: (200, prev)),
+    ]
+
+def rackspace_routes(url, scale) -> list:
+    detail = io.StringIO()
+    writer = csv.writer(detail)
+    writer.writerow(['BILL_NO', 'IMPACT_TYPE', 'EVENT_TYPE', 'RES_NAME', 'QUANTITY', 'AMOUNT'])
+    for i in range(size(20000, scale)):
+        writer.writerow(['B1', 'CHARGE', 'NG Server Uptime' if i % 3 else 'Bandwidth Out', f'vm{i % 300}', '24', '1.23'])
+    detail = detail.getvalue().encode('utf-8')
+    return [
+        ('POST', r'/rackspace/v2.0/tokens',
+            lambda r: (200, {'access': {'token': {'id': 'bench', 'expires': '2099-01-01T00:00:00Z'}}})),
+        ('GET', r'/rackspace/v2/accounts/[^/]+/estimated_charges',
+            lambda r: (200, {'estimatedCharges': {'chargeTotal': 12.5, 'currentBillingPeriodStartDate': '2021-10-01',
+                                                  'currentBillingPeriodEndDate': '2021-10-31'}})),
+        ('GET', r'/rackspace/v2/accounts/[^/]+/invoices/latest', lambda r: (200, {'invoice': {'id': 'I1'}})),
+        ('GET', r'/rackspace/v2/accounts/[^/]+/invoices/I1/detail', lambda r: (200, detail, {'Content-Type': 'text/csv'})),
+    ]
+
+def cloudsigma_routes(url, scale) -> list:
+    month = datetime.today().strftime('%Y-%m')
+    entries = [{'id': str(i), 'amount': f'{random.random() - 0.1:.4f}', 'time': f'{month}-01T{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}+00:00'}
+               for i in range(size(5000, scale))]
+
+    def ledger(request):
+        since = request.query.get('time__gte', [None])[0]
+        rows = [e for e in entries if since is None or e['time'] >= since]
+        offset = int(request.query['offset'][0])
+        limit = int(request.query['limit'][0])
+        page = rows[offset:offset + limit]
+        return 200, {'objects': page, 'meta': {'next': '...' if offset + limit < len(rows) else None}}
+
+    return [
+        ('GET', r'/cloudsigma/balance/?', lambda r: (200, {'balance': '100.00'})),
+        ('GET', r'/cloudsigma/ledger/?', ledger),
+    ]
+
+def jelastic_routes(url, scale) -> list:
+    history = {'array': [{'cost': random.random()} for _ in range(size(300, scale))]}
+    base = '/jelastic/1.0/billing/account/rest'
+    return [
+        ('GET', f'{base}/getaccountbillinghistorybyperiod', lambda r: (200, history)),
+        ('GET', f'{base}/getaccount', lambda r: (200, {'balance': 42.5})),
+    ]
+
+# Point every provider at the stub
+def point(url):
+    azure.auth_endpoint = f'{url}/azure/{{tenant_id}}/oauth2/token'
+    azure.usage_endpoint = f'{url}/azure{azure_usage.usage_path}'
+    for name in ('api_getNextInvoiceTopLevel', 'api_getChildren', 'api_getPrevInvoice', 'api_getInvoiceTopLevel', 'api_getInvoiceChildren'):
+        setattr(sl, name, getattr(sl, name).replace('https://api.softlayer.com', f'{url}/softlayer'))
+    for name in ('auth_endpoint', 'billing_endpoint', 'latest_invoice_endpoint', 'invoice_detail_endpoint'):
+        setattr(rackspace, name, getattr(rackspace, name).replace('https://identity.api.rackspacecloud.com', f'{url}/rackspace')
+                                                        .replace('https://billing.api.rackspacecloud.com', f'{url}/rackspace'))
+    cloudsigma.endpoint = f'{url}/cloudsigma'
+    cloudjiffy.endpoint = f'{url}/jelastic'
+
+# What each provider benchmark runs
+scenarios = {
+    'azure': lambda: azure.cost('bench', 'secret', 'bench', 'client', 'tenant'),
+    'softlayer': lambda: softlayer.cost('bench', 'key'),
+    'rackspace': lambda: (rackspace.cost('bench', 'key', '123'), rackspace.life('bench', 'key', '123')),
+    'cloudsigma': lambda: cloudsigma.cost('bench', 'secret'),
+    'jelastic': lambda: cloudjiffy.cost('bench', 'key'),
+}
+
+# Forget what a run keeps in memory, so every run looks like a new process
+def forget():
+    tokens.cache.clear()
+    sl.invoices_cache.clear()
+    azure.billing_cache.clear()
+
+def measure(stub, func) -> dict:
+    forget()
+    gc.collect()
+    stub.reset()
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': elapsed, 'requests': stub.requests, 'bytes': stub.bytes, 'peak_bytes': peak}
+
+# Fresh empty store for a run
+# Stores and reports of a run all go in one temporary directory, removed at exit
+scratch = None
+
+def workdir() -> Path:
+    global scratch
+    if scratch is None:
+        scratch = tempfile.TemporaryDirectory(prefix='cloudcost-bench-')
+        atexit.register(scratch.cleanup)
+    return Path(scratch.name)
+
+def fresh_store():
+    store.path = Path(tempfile.mkdtemp(prefix='store-', dir=workdir()))
+    archive.used = None
+
+# Hands run_cost the accounts, swallows what it writes back
+class Cursor:
+    def __init__(self, accounts):
+        self.accounts = accounts
+
+    def execute(self, query):
+        pass
+
+    def fetchall(self):
+        return [{'iaas': provider, 'name': name, 'cred': cred, 'enable': True} for (provider, name, cred) in self.accounts]
+
+    def callproc(self, *args):
+        pass
+
+    def copy_expert(self, query, buf):
+        pass
+
+    @property
+    def connection(self):
+        return self
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+# An account of every provider the stub serves, as (provider, name, credentials)
+accounts = [
+    ('azure', 'bench', {'password': 'secret', 'subscription': 'bench', 'client_id': 'client', 'tenant_id': 'tenant'}),
+    ('softlayer', 'bench', {'api_key': 'key'}),
+    ('bluemix', 'bench', {'api_key': 'key'}),
+    ('rackspace', 'bench', {'api_key': 'key', 'billing_number': '123'}),
+    ('cloudsigma', 'bench', {'password': 'secret'}),
+    ('cloudjiffy', 'bench', {'api_key': 'key'}),
+]
+
+def run_cost(stub, count) -> dict:
+    import cloudcost
+    cursor = Cursor([(provider, f'{name}{i}', cred) for i in range(count) for (provider, name, cred) in accounts])
+    args = argparse.Namespace(nopost=True, iaas=None, account=None, workers=None, max_age=0, refresh=False, format='xlsx',
+                              output=str(workdir()))
+    return measure(stub, lambda: cloudcost.run_cost(cursor, args=args, conf=configparser.ConfigParser()))
+
+def commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Print how results differ from an earlier run of the suite
+def compare(old, new):
+    for name in new['providers']:
+        if name not in old.get('providers', {}):
+            continue
+        for run in ('cold', 'warm'):
+            (a, b) = (old['providers'][name][run], new['providers'][name][run])
+            print(f"{name:<12}{run:<6}" + ''.join(
+                f"{metric} {b[metric] / a[metric]:6.2f}x  " if a[metric] else f"{metric} {'-':>6}   "
+                for metric in ('seconds', 'requests', 'bytes', 'peak_bytes')))
+    if 'run_cost' in old:
+        print(f"{'run_cost':<18}seconds {new['run_cost']['seconds'] / old['run_cost']['seconds']:6.2f}x")
+
+def main(args):
+    random.seed(0)
+    results = {'commit': commit(), 'scale': args.scale, 'providers': {}}
+
+    with StubServer([], latency=args.latency) as stub:
+        for make in (azure_routes, softlayer_routes, rackspace_routes, cloudsigma_routes, jelastic_routes):
+            stub.add_routes(make(stub.url, args.scale))
+        point(stub.url)
+
+        for (name, func) in scenarios.items():
+            fresh_store()
+            results['providers'][name] = {
+                'cold': measure(stub, func),
+                'warm': measure(stub, func),
+            }
+
+        fresh_store()
+        results['run_cost'] = run_cost(stub, args.accounts)
+
+    out = json.dumps(results, indent=4)
+    print(out)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(out)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=float, default=1, help='multiplies the size of the synthetic data')
+    parser.add_argument('--accounts', type=int, default=2, help='accounts per provider in the run_cost benchmark')
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds the stub waits before answering')
+    parser.add_argument('--out', type=str, required=False, help='also write the results to this json file')
+    parser.add_argument('--compare', type=str, required=False, help='results of an earlier run to compare against')
+    main(parser.parse_args())
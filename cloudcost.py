@@ -5,24 +5,47 @@ import psycopg2.extras
 from psycopg2 import sql
 
 # Python Standard stuff
-import importlib
-from importlib import util
 import argparse
-import inspect
-from datetime import datetime
-from getpass import getpass
+from datetime import datetime, timezone
 import configparser
-import requests
 from os import path
 import json
 import os
+import io
+import csv
+import time
 from pathlib import Path
-import subprocess
-
-# XLSX support
-from openpyxl import Workbook
+import threading
+from functools import partial
+
+# XLSX/CSV/JSONL report
+from report import open_report, row
+
+# Result of querying an account
+from providers.common.pool import Outcome
+# State providers keep between runs
+from providers.common import store
+# HTTP client shared by the providers
+from providers.common import httpclient
+# Its async counterpart for providers implementing acost()
+from providers.common import ahttpclient
+# Auth tokens providers reuse between calls
+from providers.common import tokens
+# Postgres connection providers keep their state on
+from providers.common import db
+# Currency rates shared by the providers
+from providers.common import rates
+# Cost results of recent runs
+from providers.common import results
+# Closed invoices kept on disk
+from providers.common import archive
+# Where the time of a run goes
+from providers.common import metrics
+# What each provider takes and supports, without importing it
+from providers.common import registry
 
 # Upload file to mattermost
+@metrics.timed('upload_file')
 def upload_file(file, server, channel_id, token, failed):
     # Simple auth header
     headers = {
@@ -44,7 +67,7 @@ def upload_file(file, server, channel_id, token, failed):
 
     # Create a new upload and grab the ID
     print("Uploading...")
-    x = requests.post(f'{server}/api/v4/files', headers=headers, params=payload, data=open(file, 'rb'))
+    x = httpclient.post(f'{server}/api/v4/files', headers=headers, params=payload, data=open(file, 'rb'))
     js = json.loads(x.text)
     if not x.ok:
         raise Exception(f'Failed to upload {file}. Response:\n{json.dumps(js,indent=4)}')
@@ -59,10 +82,11 @@ def upload_file(file, server, channel_id, token, failed):
 
     # Post the file
     print("Done.")
-    x = requests.post(f'{server}/api/v4/posts', headers=headers, json=payload)
+    x = httpclient.post(f'{server}/api/v4/posts', headers=headers, json=payload)
     if not x.ok:
         raise Exception(f'Failed to post message. Response:\n{json.dumps(x.json(),indent=4)}')
         
+@metrics.timed('post_machines')
 def post_machines(providers, server, channel_id, token):
     # Simple auth header
     headers = {
@@ -98,10 +122,11 @@ def post_machines(providers, server, channel_id, token):
         }
     }
     
-    x = requests.post(f'{server}/api/v4/posts', headers=headers, json=payload)
+    x = httpclient.post(f'{server}/api/v4/posts', headers=headers, json=payload)
     if not x.ok:
         raise Exception(f'Failed to post message. Response:\n{json.dumps(x.json(),indent=4)}')
         
+@metrics.timed('post_failures')
 def post_failures(failures, server, channel_id, token):
     # Auth headers
     headers = {
@@ -133,7 +158,7 @@ def post_failures(failures, server, channel_id, token):
         }
     }
     
-    x = requests.post(f'{server}/api/v4/posts', headers=headers, json=payload)
+    x = httpclient.post(f'{server}/api/v4/posts', headers=headers, json=payload)
     if not x.ok:
         raise Exception(f'Failed to post message. Response:\n{json.dumps(x.json(),indent=4)}')
 
@@ -155,33 +180,178 @@ def retry(func, *args, **kwargs):
             # Success, break from retry loop
             break
 
-# Creates some headers for the excel sheet
-# Returns the workbook, worksheet and starting row
-def create_xlsx():
-    # Workbook object
-    wb = Workbook()
+# Pull worker count and per provider limits from the [concurrency] section of the config
+# --workers overrides the global worker count, any other key is taken as a provider name
+# Returns workers, {provider: limit}, default per provider limit
+def concurrency(conf, args):
+    section = dict(conf['concurrency']) if conf.has_section('concurrency') else {}
+    workers = int(section.pop('workers', 8))
+    default_limit = int(section.pop('per_provider', 4))
+    if 'workers' in args and args.workers:
+        workers = args.workers
+    limits = {k: int(v) for (k,v) in section.items()}
+    return workers, limits, default_limit
+
+# Providers we've handed their config section to
+configured = set()
+configured_lock = threading.Lock()
+
+# Import a module named with the provider from the providers directory
+# If the provider has a configure() function and the config has a [provider.<name>] section
+# it's handed that section the first time the provider is loaded
+def load_provider(provider, conf):
+    module = registry.load(provider)
+    with configured_lock:
+        if provider not in configured:
+            configured.add(provider)
+            section = f'provider.{provider}'
+            if registry.supports(provider, 'configure') and conf.has_section(section):
+                module.configure(conf[section])
+    return module
+
+# Cached result of an account as cost_account() returns it, None if it has to be queried
+# Results fresher than max_age seconds (default the provider's ttl) are served from the cache unless refresh
+def cached(provider, name, cred, max_age=None, refresh=False):
+    if refresh:
+        return None
+    hit = results.get(provider, name, cred, results.max_age(provider) if max_age is None else max_age)
+    if hit:
+        print(f'{provider} {name} served from cache, fetched {hit[2].isoformat()}')
+        return (*hit, True)
+    return None
+
+# Cache what an account reported, returns it as cost_account() does
+def remember(provider, name, cred, costs, pvms, fetched, latency):
+    # Failing to cache only costs us the next run querying this account again
+    try:
+        results.put(provider, name, cred, costs, pvms, fetched, latency)
+    except Exception as err:
+        print(f"Failed to cache {provider} {name}: {err}")
+
+    return costs, pvms, fetched, latency, False
 
-    # Grab active sheet, change title
-    ws = wb.active
-    ws.title = "Cloud Cost"
+# Runs cost (and life if its the start of a billing cycle) for a single account on drive()'s worker threads,
+# anything raised is collected by drive(). Returns (costs, pvms, fetched, latency, cached)
+def cost_account(provider, name, cred, conf, max_age=None, refresh=False):
+    hit = cached(provider, name, cred, max_age, refresh)
+    if hit:
+        return hit
 
-    # Reporting dates
-    ws['A1'] = 'Report Made:'
-    ws['B1'] = datetime.today()
-    ws['B1'].number_format = 'yyyy-mm-dd'
+    module = load_provider(provider, conf)
+
+    # Call out to provider module's cost() function, timing it for the snapshot history
+    start = time.perf_counter()
+    with metrics.span('cost', provider=provider, account=name):
+        costs = module.cost(name, **cred)
+    latency = time.perf_counter() - start
+    fetched = datetime.now(timezone.utc)
+
+    # Wrap in another try block so we don't kill cost if this fails
+    pvms = None
+    try:
+        # Only run if this provider has this implemented and start of new billing cycle
+        today = datetime.utcnow().isoformat()
+        if registry.supports(provider, 'life') and costs[0].startDate[:10] == today[:10]:
+            with metrics.span('life', provider=provider, account=name):
+                pvms = module.life(name, **cred)
+    except Exception as err:
+        print(f"Failed to run life() on {provider} {name}: {err}")
 
-    # Headers
-    ws['A3'] = 'Provider'
-    ws['B3'] = 'Billing Start'
-    ws['C3'] = 'Billing End'
-    ws['D3'] = 'Account Name'
-    ws['E3'] = 'Current Invoice'
-    ws['F3'] = 'Balance'
+    return remember(provider, name, cred, costs, pvms, fetched, latency)
 
-    # Return workbook, worksheet, starting row index
-    return wb, ws, 4
+# cost_account() for providers implementing acost(), run as a task on aio's event loop
+# The results cache and a life() without an async variant run on threads, off the loop
+async def acost_account(provider, name, cred, conf, max_age=None, refresh=False):
+    import asyncio
+
+    hit = await asyncio.to_thread(cached, provider, name, cred, max_age, refresh)
+    if hit:
+        return hit
+
+    module = load_provider(provider, conf)
+
+    start = time.perf_counter()
+    with metrics.span('cost', provider=provider, account=name):
+        costs = await module.acost(name, **cred)
+    latency = time.perf_counter() - start
+    fetched = datetime.now(timezone.utc)
+
+    pvms = None
+    try:
+        today = datetime.utcnow().isoformat()
+        if registry.supports(provider, 'life') and costs[0].startDate[:10] == today[:10]:
+            with metrics.span('life', provider=provider, account=name):
+                if registry.supports(provider, 'alife'):
+                    pvms = await module.alife(name, **cred)
+                else:
+                    pvms = await asyncio.to_thread(module.life, name, **cred)
+    except Exception as err:
+        print(f"Failed to run life() on {provider} {name}: {err}")
+
+    return await asyncio.to_thread(remember, provider, name, cred, costs, pvms, fetched, latency)
+
+# Query every account of todo, a list of (provider, name, cred), with cost_account()'s kwargs
+# Accounts of providers implementing acost() run as tasks on aio's event loop, holding no thread while they wait,
+# any other provider's run cost_account() on a pool of workers threads
+# Either way limits caps the accounts of a provider in flight at once, providers not in limits at default_limit
+# Yields an Outcome per account in todo's order, as soon as it and every one before it are done
+def drive(todo, workers, limits, default_limit, **kwargs):
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from providers.common import aio
+
+    slots = {provider: asyncio.Semaphore(max(1, limits.get(provider, default_limit))) for provider in set(p for (p, _, _) in todo)}
+    pool = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    async def run(provider, name, cred):
+        async with slots[provider]:
+            # Unknown providers go the sync way, where cost_account() raises for them
+            if registry.exists(provider) and registry.supports(provider, 'acost'):
+                return await acost_account(provider, name, cred, **kwargs)
+            func = metrics.bind(partial(cost_account, provider, name, cred, **kwargs))
+            return await asyncio.get_running_loop().run_in_executor(pool, func)
+
+    futures = []
+    try:
+        futures = [aio.submit(run(*account)) for account in todo]
+        for future in futures:
+            try:
+                yield Outcome(future.result())
+            except Exception as err:
+                yield Outcome(error=err)
+    finally:
+        # Only left to do if we were stopped early
+        for future in futures:
+            future.cancel()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+# Write this run's cost items to the cost_snapshots history in a single COPY
+# rows are (provider, account, CostItem, fetched_at, latency)
+def save_snapshots(cur, rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for (provider, name, cost, fetched, latency) in rows:
+        writer.writerow([
+            provider,
+            name,
+            cost.startDate[:10] if cost.startDate else None,
+            cost.endDate[:10] if cost.endDate else None,
+            f"{round(float(cost.cost), 2):.2f}",
+            cost.balance,
+            fetched.isoformat(),
+            latency,
+        ])
+    buf.seek(0)
+
+    # The partition for this month has to exist before we copy into it
+    for month in set(fetched.date().replace(day=1) for (*_, fetched, _) in rows):
+        cur.callproc('create_snapshot_partition', (month,))
+    cur.copy_expert('copy cost_snapshots (provider, account, period_start, period_end, cost, balance, fetched_at, latency) '
+                    'from stdin with (format csv)', buf)
+    cur.connection.commit()
 
 # Queries DB and runs cost against all accounts, all providers
+@metrics.timed('run_cost')
 def run_cost(cur, **kwargs):
     args = kwargs['args']
     conf = kwargs['conf']
@@ -189,8 +359,11 @@ def run_cost(cur, **kwargs):
     if args.nopost:
         print('Not Posting.')
     
-    # Set up our workbook
-    wb, ws, row = create_xlsx()
+    # Set up our report, rows are written as the accounts report in
+    format = args.format if 'format' in args and args.format else 'xlsx'
+    directory = args.output if 'output' in args and args.output else '/tmp'
+    fname = path.join(directory, "cloudcost{}.{}".format(datetime.today().strftime("%Y-%m-%d"), format))
+    report = open_report(format, fname)
 
     query = sql.SQL('select iaas, name, cred, enable from get_accounts({iaas});').format(
             iaas = sql.Literal([args.iaas] if 'iaas' in args and args.iaas else None)
@@ -200,9 +373,8 @@ def run_cost(cur, **kwargs):
     # fetchall() will return us a dictionary of lists
     accounts = cur.fetchall()
 
-    # Now we loop through each provider
-    failed = []
-    vms = {}
+    # Filter down to the accounts we're going to run before handing them to the pool
+    todo = []
     for account in accounts:
         provider = account['iaas']
         name = account['name']
@@ -215,53 +387,69 @@ def run_cost(cur, **kwargs):
         if not account['enable']:
             print(f'Skipping account {provider} - {name}')
             continue
-    
+
+        todo.append((provider, name, account['cred']))
+
+    # Query every account concurrently, results come back in the same order as todo (orderi)
+    workers, limits, default_limit = concurrency(conf, args)
+
+    # Providers can ask for a different limit than the default, the config still wins
+    # Async or not, only a provider capping its own requests (ie the Jelastic hosts) asks for many more
+    for provider in set(p for (p, _, _) in todo) - set(limits):
         try:
-            # Import a module named with the provider from the providers directory
-            module = importlib.import_module("providers.{}".format(provider))
+            limits[provider] = registry.concurrency(provider, default_limit)
+        except Exception:
+            # Unknown providers are reported for each of their accounts when they run
+            pass
 
-            # Call out to provider module's cost() function
-            costs = module.cost(name, **account['cred'])
-            
-            # Wrap in another try block so we don't kill cost if this fails
-            try:
-                # Only run if this provider has this implemented and start of new billing cycle
-                today = datetime.utcnow().isoformat()
-                if hasattr(module, 'life') and costs[0].startDate[:10] == today[:10]:
-                    pvms = module.life(name, **account['cred'])
-                
-                    if pvms:
-                        vms[account] = pvms
-            except Exception as err:
-                print(f"Failed to run life() on {provider} {name}: {err}")
+    max_age = args.max_age if 'max_age' in args else None
+    refresh = args.refresh if 'refresh' in args else False
+    outcomes = drive(todo, workers, limits, default_limit, conf=conf, max_age=max_age, refresh=refresh)
 
-            # Spill to excel
+    # Now we loop through each result, in account order as soon as it's in
+    failed = []
+    vms = {}
+    snapshots = []
+    for (provider, name, cred), outcome in zip(todo, outcomes):
+        try:
+            # Two things can lead here, module import failing and cost() failing
+            if outcome.error is not None:
+                raise outcome.error
+            costs, pvms, fetched, latency, cached = outcome.result
+
+            # Machines are grouped by provider, which is what post_machines() expects
+            if pvms:
+                vms.setdefault(provider, {}).update(pvms)
+
+            # Spill to the report
             # Since we now return a list of CostItems to accomodate for
             # Bluemix and Softlayer returning both previous and current billing
             # periods, loop through the list of CostItems returned
-            # TODO: Gotta be a neater way to do this
             for cost in costs:
-                ws[f'A{row}'] = provider
-                # Split the string, if it contains more than a date, we only want the date
-                ws[f'B{row}'] = cost.startDate[:10] if cost.startDate else ''
-                ws[f'C{row}'] = cost.endDate[:10] if cost.endDate else ''
-                ws[f'D{row}'] = name
-                ws[f'E{row}'] = f"{round(float(cost.cost), 2):.2f}"
-                ws[f'F{row}'] = cost.balance
-                row = row + 1
+                report.write(row(provider, name, cost))
 
                 print("{} total cost to month is {}".format(name, cost))
 
+                # Cached results are already in the history from the run that fetched them
+                if not cached:
+                    snapshots.append((provider, name, cost, fetched, latency))
+
 
-        # Two things can lead here, module import failing and sql query failure
         # Skip this provider in this case
         except BaseException as err:
             print(f"{provider} {name} Failed with {err}")
             failed.append({'iaas': provider, 'name': name, 'error': err})
 
-    # Save to the workbook
-    fname = "/tmp/cloudcost{}.xlsx".format(datetime.today().strftime("%Y-%m-%d"))
-    wb.save(fname)
+    # Finish the report
+    report.close()
+
+    # Keep the history, losing it shouldn't cost us the spreadsheet
+    if snapshots:
+        try:
+            save_snapshots(cur, snapshots)
+        except psycopg2.Error as err:
+            cur.connection.rollback()
+            print(f'Failed to save cost snapshots: {err}')
 
     if args.nopost:
         return
@@ -279,6 +467,7 @@ def run_cost(cur, **kwargs):
     # Retry upload 5 times
     retry(upload_file, fname, **conf['mattermost'], failed=failed)
         
+@metrics.timed('run_life')
 def run_life(cur, **kwargs):
     args = kwargs['args']
     provider = args.iaas
@@ -300,12 +489,12 @@ def run_life(cur, **kwargs):
             continue
         
         try:
-            # Import module, try the life commmand
-            module = importlib.import_module("providers.{}".format(iaas))
-            
-            if hasattr(module, 'life'):
+            # Only import the providers that have a life command
+            if registry.supports(iaas, 'life'):
+                module = load_provider(iaas, conf)
                 print(f'Checking {name}...')
-                pvms = module.life(name, **account['cred'])
+                with metrics.span('life', provider=iaas, account=name):
+                    pvms = module.life(name, **account['cred'])
                 
                 if pvms:
                     vms[iaas] = pvms
@@ -319,6 +508,20 @@ def run_life(cur, **kwargs):
     elif vms:
         retry(post_machines, vms, **conf['mattermost'])
 
+# Prompt for the credentials a provider's cost() takes, as recorded in the registry's manifest
+# Arguments with a default are optional, leaving them blank leaves them out
+def prompt_cred(provider) -> dict:
+    from getpass import getpass
+
+    entry = registry.get(provider)
+    cred = {}
+    for a in entry['fields']:
+        cred[a] = getpass(f'{a}: ')
+    for a in entry['optional']:
+        if (value := getpass(f'{a} (optional): ')):
+            cred[a] = value
+    return cred
+
 # Add a new account to the DB
 def add_account(cur, **kwargs):
     args = kwargs['args']
@@ -332,23 +535,14 @@ def add_account(cur, **kwargs):
     ))
     
     if cur.fetchone()[0] is None:
-        try:
-            module = importlib.import_module("providers.{}".format(provider))
-        except:
-            raise Exception(f'The provider {provider} does not have an implementation')
+        # Raises if there's no such provider
+        registry.get(provider)
         cur.execute(sql.SQL('select create_iaas({iaas});').format(
             iaas = sql.Literal(provider)
         ))
     
     try:
-        module = importlib.import_module("providers.{}".format(provider))
-
-        # Get argument names from module's run command
-        argspec = inspect.getfullargspec(module.cost)
-        # argspec[0] is a list of names of standard arguments
-        cols = argspec[0]
-        
-        cred = dict((f'{a}', getpass(f'{a}: ')) for a in filter(lambda a: a != 'account_name',cols))
+        cred = prompt_cred(provider)
 
         # Build arbritary insert using the psycopg2 sql extension
         # Need to convert everything into Identifier and Literal for this to work so map cols and vals
@@ -376,15 +570,7 @@ def update_account(cur, **kwargs):
     # First check if provider module exists
     # It doesn't we can't do anything
     try:
-        module = importlib.import_module("providers.{}".format(provider))
-
-        # Get argument names from module's run command
-        argspec = inspect.getfullargspec(module.cost)
-        # argspec[0] is a list of names of standard arguments
-        # In this case just remove account_name from the list since we won't touch it
-        cols = filter(lambda a: a != 'account_name', argspec[0])
-        
-        cred = dict((f'{a}', getpass(f'{a}: ')) for a in filter(lambda a: a != 'account_name',cols))
+        cred = prompt_cred(provider)
 
         # Build arbritary insert using the psycopg2 sql extension
         # Need to convert everything into Identifier and Literal for this to work so map cols and vals
@@ -432,6 +618,13 @@ def list_account(cur, **kwargs):
         # Just loop through every row in every table as filtered above and print account_name
         for account in accounts:
             print(f"{account['iaas']}: {account['name']}")
+    # Every provider we have an implementation of, with the credentials it takes
+    elif args.type == 'implementations':
+        for name in registry.names():
+            entry = registry.get(name)
+            fields = entry['fields'] + [f'[{f}]' for f in entry['optional']]
+            extras = [x for x in ('async' if entry['acost'] else None, 'life' if entry['life'] else None, entry['backend']) if x]
+            print(f"{name}: {' '.join(fields)}" + (f" ({', '.join(extras)})" if extras else ''))
 
 # Remove an account from the DB
 def remove_account(cur, **kwargs):
@@ -463,6 +656,7 @@ def order_accounts(cur, **kwargs):
             f.write(f"{account['iaas']} | {account['name']}\n")
     
     cmd = os.environ.get('EDITOR', 'vi') + ' /tmp/order.lst'
+    import subprocess
     subprocess.call(cmd, shell=True)
     
     with open('/tmp/order.lst', 'r') as f:
@@ -485,6 +679,39 @@ def main(args):
         conf = configparser.ConfigParser()
         conf.read("/etc/cloudcost/cloudcost.conf")
 
+        # Providers keep some of their state in postgres on their own connection
+        if conf.has_section('database'):
+            db.configure(conf['database'])
+
+        # Optionally move where providers keep state between runs
+        if conf.has_section('store'):
+            store.configure(conf['store'])
+
+        # Optionally tune the providers' connection pools and timeouts
+        if conf.has_section('http'):
+            httpclient.configure(conf['http'])
+            ahttpclient.configure(conf['http'])
+
+        # Optionally keep auth tokens between runs
+        if conf.has_section('tokens'):
+            tokens.configure(conf['tokens'])
+
+        # Optionally refresh currency rates from elsewhere and keep them in the database
+        if conf.has_section('rates'):
+            rates.configure(conf['rates'])
+
+        # Optionally change how long cost results are reused for
+        if conf.has_section('cache'):
+            results.configure(conf['cache'])
+
+        # Optionally move or resize the closed invoice archive
+        if conf.has_section('archive'):
+            archive.configure(conf['archive'])
+
+        # Optionally export where the time of the run went
+        if conf.has_section('metrics'):
+            metrics.configure(conf['metrics'])
+
         # Directly pass the config file as argument
         # ** formats it to pass the dictionary as named arguments
         conn = psycopg2.connect(**conf['database'])
@@ -498,7 +725,12 @@ def main(args):
             # Handle this by simpling calling the set function by argparse
             # We can pass anything the functions may need since they're declared
             # as kwargs
-            args.func(cur, args=args, conf=conf)
+            if args.profile:
+                # Only pulled in when asked for, profiling costs nothing otherwise
+                import profiling
+                profiling.profile(args.profile, lambda: args.func(cur, args=args, conf=conf), args.profile_interval)
+            else:
+                args.func(cur, args=args, conf=conf)
                 
 
     # Did we screw up connecting to database?
@@ -510,6 +742,13 @@ def main(args):
         print(f"Unexpected {err=}, {type(err)=}")
 
     finally:
+        # Export where the time went, even if the run fell over
+        if args.func in (run_cost, run_life):
+            try:
+                metrics.export(args.func.__name__)
+            except Exception as err:
+                print(f'Failed to export metrics: {err}')
+
         # Need to clean up connection if made it
         if conn is not None:
             conn.close()
@@ -520,11 +759,18 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.set_defaults(func=run_cost)
     parser.add_argument('--nopost', help='do not post to MM', action='store_true')
+    parser.add_argument('--profile', type=str, required=False, metavar='DIR', help='sample the command and write collapsed stacks per provider to DIR')
+    parser.add_argument('--profile-interval', type=float, default=0.005, help='seconds between profiler samples')
     subparsers = parser.add_subparsers(help='sub-commands, type <command> --help to get more information')
     
     sub_cost = subparsers.add_parser('cost', help='runs the cost function and posts to MM')
     sub_cost.add_argument('--iaas', type=str, required=False, help='iaas to modify account in')
     sub_cost.add_argument('--account', type=str, required=False, help='account to modify')
+    sub_cost.add_argument('--workers', type=int, required=False, help='number of accounts to query at once')
+    sub_cost.add_argument('--max-age', type=int, required=False, help='reuse cost results at most this many seconds old, 0 to query every account')
+    sub_cost.add_argument('--refresh', action='store_true', help='query every account, ignoring cached results')
+    sub_cost.add_argument('--format', choices=['xlsx', 'csv', 'jsonl'], required=False, help='report format, xlsx by default')
+    sub_cost.add_argument('--output', type=str, required=False, metavar='DIR', help='directory to write the report to, /tmp by default')
     sub_cost.set_defaults(func=run_cost)
     
     sub_life = subparsers.add_parser('life', help='runs a check on the previous invoice and alerts for things alive longer than a time')
@@ -532,8 +778,8 @@ if __name__ == '__main__':
     sub_life.add_argument('--account', type=str, required=False, help='single account to run this against')
     sub_life.set_defaults(iaas=None, func=run_life)
     
-    sub_list = subparsers.add_parser('list', help='list accounts or providers')
-    sub_list.add_argument('type', choices=['accounts', 'providers'], help='the item to list')
+    sub_list = subparsers.add_parser('list', help='list accounts, providers in the database or provider implementations')
+    sub_list.add_argument('type', choices=['accounts', 'providers', 'implementations'], help='the item to list')
     sub_list.add_argument('--iaas', action='extend', nargs='+', type=str, required=False, help='optional list of providers to list accounts from')
     sub_list.set_defaults(iaas=None, func=list_account)
     
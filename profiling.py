@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import threading
+
+from providers.common import aio
+from providers.common import metrics
+
+# Sampling profiler behind --profile, only imported and started when asked for so it costs nothing otherwise
+# Every interval the stack of every thread is recorded, and the sample counted against the provider
+# the thread is working for (see metrics.active). Idle threads waiting on a lock or queue are skipped
+# aio's loop runs every async provider's tasks in turn on one thread, its samples go by the labels
+# of the task running at the time instead
+# Writes collapsed stacks, one file per provider plus a combined one with the provider as the root frame,
+# readable by flamegraph.pl, speedscope, inferno and friends
+
+# Modules whose frames at the top of a stack mean the thread is just waiting on another
+idle = ('threading', 'queue', 'concurrent.futures.thread', 'selectors')
+
+class Sampler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.counts = {}
+        self.samples = 0
+        self.stop = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        me = threading.get_ident()
+        while not self.stop.wait(self.interval):
+            for (ident, frame) in sys._current_frames().items():
+                if ident == me or frame.f_globals.get('__name__') in idle:
+                    continue
+                if aio.thread is not None and ident == aio.thread.ident:
+                    context = aio.running_context()
+                    current = context.get(metrics.labels, {}) if context is not None else {}
+                else:
+                    current = metrics.active.get(ident, {})
+                provider = current.get('provider') or 'cloudcost'
+                key = (provider, stack(frame))
+                self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+
+    def finish(self):
+        self.stop.set()
+        self.thread.join()
+
+    # Write <provider>.collapsed for each provider and combined.collapsed under directory
+    # Returns the files written
+    def write(self, directory) -> list:
+        os.makedirs(directory, exist_ok=True)
+        providers = {}
+        for ((provider, frames), count) in self.counts.items():
+            providers.setdefault(provider, []).append((frames, count))
+
+        files = []
+        with open(os.path.join(directory, 'combined.collapsed'), 'w') as combined:
+            for (provider, stacks) in sorted(providers.items()):
+                file = os.path.join(directory, f'{provider}.collapsed')
+                with open(file, 'w') as f:
+                    for (frames, count) in sorted(stacks):
+                        f.write(f'{frames} {count}\n')
+                        combined.write(f'{provider};{frames} {count}\n')
+                files.append(file)
+        files.append(os.path.join(directory, 'combined.collapsed'))
+        return files
+
+# Frames of a stack root first, as module.function separated by ;
+def stack(frame) -> str:
+    frames = []
+    while frame is not None:
+        frames.append(f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(frames))
+
+# Profile func(), writing what we sampled to directory
+def profile(directory, func, interval=0.005):
+    sampler = Sampler(interval).start()
+    start = time.perf_counter()
+    try:
+        return func()
+    finally:
+        sampler.finish()
+        files = sampler.write(directory)
+        print(f'Profiled {sampler.samples} samples over {time.perf_counter() - start:.1f}s into {", ".join(files)}')
@@ -1,29 +1,137 @@
 # do the amazon thing
 import json
+import hashlib
+import threading
 import subprocess
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
 from providers.base import CostItem
+from providers.common import aws
 
-def cost(account_name, access_key_id, secret_access_key) -> "list[CostItem]":
-    # we can override AWS config file with environment variables
-    envVar = {
-        'AWS_ACCESS_KEY_ID': access_key_id,
-        'AWS_SECRET_ACCESS_KEY': secret_access_key
-    }
+# We talk to Cost Explorer in process, set True to go back to spawning the aws cli
+use_cli = False
 
+# Path to the aws cli, only used if use_cli is set
+aws_cli = '/usr/local/bin/aws'
+
+# Linked accounts of an organization can be reported from a single query against the payer
+# Keyed by a hash of the payer credential, the query and its period, each with its own lock so
+# every linked account running concurrently waits on the one query
+linked_cache = {}
+linked_lock = threading.Lock()
+
+# Months back we look for a linked account before calling its id unknown to the payer
+lookback_months = 12
+
+def cost(account_name, access_key_id, secret_access_key, account_id=None) -> "list[CostItem]":
     # Some date magic
     # Just first of this month, Start is inclusive
     first_day = datetime.today().replace(day=1).strftime('%Y-%m-%d')
     # This increments month by 1 and sets day to 1, End is exclusive
     last_day = (datetime.today()+relativedelta(months=1, day=1)).strftime('%Y-%m-%d')
 
+    # Consolidated mode, the credentials are the payer's and account_id is the linked account we want
+    if account_id:
+        costs = linked_costs(first_day, last_day, access_key_id, secret_access_key)
+        if account_id in costs:
+            return [CostItem(costs[account_id], first_day, last_day)]
+        # Nothing billed to the account yet this period (always the case on the 1st), it simply has no group
+        # Only an id the payer hasn't seen in lookback_months is an error, most likely a mistyped one
+        if account_id not in linked_accounts(last_day, access_key_id, secret_access_key):
+            raise Exception(f'Account {account_id} is not linked to this payer')
+        return [CostItem('0', first_day, last_day)]
+
+    if use_cli:
+        js = get_cost_and_usage_cli(first_day, last_day, access_key_id, secret_access_key)
+    else:
+        js = aws.ce('GetCostAndUsage', {
+            'TimePeriod': {'Start': first_day, 'End': last_day},
+            'Granularity': 'MONTHLY',
+            'Metrics': ['BlendedCost'],
+        }, access_key_id, secret_access_key)
+
+    ret = [
+     CostItem(js['ResultsByTime'][0]['Total']['BlendedCost']['Amount'],
+              first_day,
+              last_day)
+     ]
+    return ret
+
+# Run fetch() once per key for every linked account sharing it, returns what it returned
+def linked_once(key, fetch):
+    with linked_lock:
+        if key not in linked_cache:
+            linked_cache[key] = {'lock': threading.Lock(), 'value': None}
+        entry = linked_cache[key]
+
+    with entry['lock']:
+        # Nothing stored if a previous attempt failed, so we just try again
+        if entry['value'] is None:
+            entry['value'] = fetch()
+        return entry['value']
+
+def payer(access_key_id, secret_access_key) -> str:
+    return hashlib.sha256(f'{access_key_id}:{secret_access_key}'.encode()).hexdigest()
+
+# One query with the payer's credentials grouped by linked account
+# Returns {account id: amount} for every linked account with costs this period
+def linked_costs(first_day, last_day, access_key_id, secret_access_key) -> dict:
+    def fetch():
+        payload = {
+            'TimePeriod': {'Start': first_day, 'End': last_day},
+            'Granularity': 'MONTHLY',
+            'Metrics': ['BlendedCost'],
+            'GroupBy': [{'Type': 'DIMENSION', 'Key': 'LINKED_ACCOUNT'}],
+        }
+        costs = {}
+        # Large organizations page their groups
+        while True:
+            js = aws.ce('GetCostAndUsage', payload, access_key_id, secret_access_key)
+            for result in js['ResultsByTime']:
+                for group in result['Groups']:
+                    costs[group['Keys'][0]] = group['Metrics']['BlendedCost']['Amount']
+            if not js.get('NextPageToken'):
+                break
+            payload['NextPageToken'] = js['NextPageToken']
+        return costs
+    return linked_once((payer(access_key_id, secret_access_key), 'costs', first_day, last_day), fetch)
+
+# Ids of every account linked to the payer with any usage in the lookback_months before last_day
+# Only asked for when a linked account has no costs this period, once per payer
+def linked_accounts(last_day, access_key_id, secret_access_key) -> set:
+    start = (datetime.strptime(last_day, '%Y-%m-%d') - relativedelta(months=lookback_months)).strftime('%Y-%m-%d')
+    def fetch():
+        payload = {
+            'TimePeriod': {'Start': start, 'End': last_day},
+            'Dimension': 'LINKED_ACCOUNT',
+            'Context': 'COST_AND_USAGE',
+        }
+        accounts = set()
+        while True:
+            js = aws.ce('GetDimensionValues', payload, access_key_id, secret_access_key)
+            accounts.update(v['Value'] for v in js['DimensionValues'])
+            if not js.get('NextPageToken'):
+                break
+            payload['NextPageToken'] = js['NextPageToken']
+        return accounts
+    return linked_once((payer(access_key_id, secret_access_key), 'accounts', start, last_day), fetch)
+
+# The old way, get-cost-and-usage through the aws cli
+# Kept around for comparison (bench/aws_startup.py) and as a fallback
+# endpoint_url points the cli at somewhere other than AWS (ie a local stub)
+def get_cost_and_usage_cli(first_day, last_day, access_key_id, secret_access_key, endpoint_url=None) -> dict:
+    # we can override AWS config file with environment variables
+    envVar = {
+        'AWS_ACCESS_KEY_ID': access_key_id,
+        'AWS_SECRET_ACCESS_KEY': secret_access_key
+    }
+
     # We're gonna use subprocess.run to do thissss
     # Requires arguments be passed in a list
     # list items are where we would typically separate by space
     cmd = [
-        '/usr/local/bin/aws',
+        aws_cli,
         'ce',
         'get-cost-and-usage',
         '--time-period',
@@ -33,6 +141,8 @@ def cost(account_name, access_key_id, secret_access_key) -> "list[CostItem]":
         '--metrics',
         'BlendedCost',
     ]
+    if endpoint_url:
+        cmd += ['--endpoint-url', endpoint_url]
 
     # do the command, pass our environment variables, capture the output as text
     ret = subprocess.run(
@@ -41,16 +151,9 @@ def cost(account_name, access_key_id, secret_access_key) -> "list[CostItem]":
             capture_output = True,
             text = True,
         )
- 
+
     if ret.returncode != 0:
         raise Exception(f'process call get-cost-and-usage failed:\n{ret.stderr}')
-  
-    # Parse as json, makes my life easy
-    js = json.loads(ret.stdout)
 
-    ret = [
-     CostItem(js['ResultsByTime'][0]['Total']['BlendedCost']['Amount'],
-              first_day,
-              last_day)
-     ]
-    return ret
+    # Parse as json, makes my life easy
+    return json.loads(ret.stdout)
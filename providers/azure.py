@@ -1,14 +1,52 @@
-import requests
+import re
 import json
+import time
+import asyncio
+import hashlib
+from urllib.parse import urlencode
+from datetime import datetime, date, timedelta
+from dateutil.relativedelta import relativedelta
 
 from providers.base import CostItem
+from providers.common import aio
+from providers.common import ahttpclient
+from providers.common import tokens
+from providers.common import jsonstream
+from providers.common import store
 
 auth_endpoint = 'https://login.microsoftonline.com/{tenant_id}/oauth2/token'
 usage_endpoint = 'https://management.azure.com/subscriptions/{subscriptionId}/providers/Microsoft.Consumption/usageDetails'
 period_endpoint = 'https://management.azure.com/subscriptions/{subscriptionId}/providers/Microsoft.Billing/billingPeriods?api-version=2017-04-24-preview'
+query_endpoint = 'https://management.azure.com{scope}/providers/Microsoft.CostManagement/query?api-version=2021-10-01'
 
-def cost(account_name, password, subscription, client_id, tenant_id) -> "list[CostItem]":
+# How we get the month to date cost
+# 'usage' sums every itemised usageDetails line, 'query' asks cost management for the total
+# already aggregated, a couple of small calls instead of hundreds of MB of line items
+mode = 'usage'
 
+# What each mode sums, the same measure so a subscription reports the same total either way:
+# the cost actually billed after discounts, before tax, in USD whatever the billing currency
+usage_cost = 'costInUSD'
+query_cost = 'PreTaxCostUSD'
+
+# In usage mode only fetch usage since the last run, on top of a stored running total
+# The last trailing_days days are always fetched again to pick up records that arrive late
+incremental = False
+trailing_days = 3
+
+# Called from cloudcost.py with the [provider.azure] config section
+def configure(section):
+    global mode, stream_pages, incremental, trailing_days
+    mode = section.get('mode', mode)
+    if mode not in ('usage', 'query'):
+        raise Exception(f'Unknown azure mode {mode}')
+    incremental = str(section.get('incremental', incremental)).lower() in ('1', 'true', 'yes', 'on')
+    trailing_days = int(section.get('trailing_days', trailing_days))
+    stream_pages = str(section.get('stream_pages', stream_pages)).lower() in ('1', 'true', 'yes', 'on')
+
+# Trade our client secret for a token
+# Returns the token and its expiry as a unix timestamp
+async def authenticate(password, client_id, tenant_id):
     # Build payload for authentication 
     data = {
         'grant_type': 'client_credentials',
@@ -18,18 +56,60 @@ def cost(account_name, password, subscription, client_id, tenant_id) -> "list[Co
     }
 
     # Do the auth, grab the token
-    x = requests.post(auth_endpoint.format(tenant_id=tenant_id), data=data)
+    x = await ahttpclient.post(auth_endpoint.format(tenant_id=tenant_id), data=data)
     js = json.loads(x.text)
     if not x.ok:
         raise Exception(f'authentication failed:\n{json.dumps(js,indent=4)}')
-    
-    token = js['access_token']
+
+    # expires_on is a unix timestamp (as a string), fall back on expires_in (seconds)
+    if 'expires_on' in js:
+        expires = float(js['expires_on'])
+    else:
+        expires = time.time() + float(js.get('expires_in', 0))
+    return js['access_token'], expires
+
+# Usage pages can run to hundreds of MB, so stream each one through a parser that only
+# keeps one item in memory, while the next page is downloaded by another task
+# Set False to go back to loading every page in full
+stream_pages = True
+
+# Bytes read off the socket at a time, and how many of those we buffer ahead of the parser
+chunk_size = 64 * 1024
+prefetch_chunks = 64
+
+# nextLink is the last key of the page, match it at the very end so the downloader
+# can go on to the next page before the parser gets there
+tail_size = 16 * 1024
+trailing_link = re.compile(rb'"nextLink"\s*:\s*("(?:[^"\\]|\\.)*"|null)\s*}\s*$')
+
+def cost(account_name, password, subscription, client_id, tenant_id, billing_account=None) -> "list[CostItem]":
+    return aio.run(acost(account_name, password, subscription, client_id, tenant_id, billing_account))
+
+async def acost(account_name, password, subscription, client_id, tenant_id, billing_account=None) -> "list[CostItem]":
+
+    # Subscriptions under the same app registration share a token
+    credential = (tenant_id, client_id, password)
+    token = await tokens.aget('azure', credential, lambda: authenticate(password, client_id, tenant_id))
 
     # Headers
     headers = {
         'Authorization': f'Bearer {token}'
     }
 
+    if mode == 'query':
+        (startDate, endDate) = await billing_period(subscription, headers, credential)
+
+        # With a billing account every subscription under it comes out of a single query
+        # A subscription with no spend yet (or any on day 1 while cost management catches up) has no row
+        # Failed queries raise in query_total(), so a missing row is a total of 0, as usage mode reports it
+        if billing_account:
+            costs = await billing_account_costs(billing_account, startDate, endDate, headers, credential)
+            total = costs.get(subscription.lower(), 0)
+        else:
+            costs = await query_total(f'/subscriptions/{subscription}', startDate, endDate, headers, credential)
+            total = costs.get(None, 0)
+        return [CostItem(total, startDate, endDate)]
+
     # Parameters for the initial request
     params = {
         # Microsoft, thats all I have to say
@@ -38,30 +118,186 @@ def cost(account_name, password, subscription, client_id, tenant_id) -> "list[Co
         '$expand': 'properties/meterDetails',
     }
 
+    if incremental:
+        (total, startDate, endDate) = await usage_incremental(subscription, params, headers, credential)
+    else:
+        (total, startDate, endDate) = await usage_total(subscription, params, headers, credential)
+
+    # Return a list of namedtuple CostItem()
+    ret = [
+        CostItem(total, startDate, endDate),
+    ]
+    return ret
+
+# Async iterator of every usage item of the subscription matching params
+def usage_items(subscription, params, headers, credential):
     # This is the initial request, you could just manually append the parameters to the URL but this is easier to change
     # We're just building the URL and makes looping later cleaner
-    p = requests.Request('GET', usage_endpoint.format(subscriptionId=subscription), params=params).prepare()
-    next_url = p.url
-    
+    url = f'{usage_endpoint.format(subscriptionId=subscription)}?{urlencode(params)}'
+
+    if stream_pages:
+        return usage_stream(url, headers, credential)
+    return usage_pages(url, headers, credential)
+
+# Sum the whole month of usage
+# Returns total, startDate, endDate
+async def usage_total(subscription, params, headers, credential):
     startDate = None
     endDate = None
 
     total = 0
+    # Loop through the returned itemized JSON and total
+    async for i in usage_items(subscription, params, headers, credential):
+        total += i['properties'][usage_cost]
+
+        # If we haven't grabbed the billing start and end dates do so now
+        if startDate is None:
+            startDate = i['properties']['servicePeriodStartDate']
+            endDate = i['properties']['servicePeriodEndDate']
+
+    return total, startDate, endDate
+
+# Sum only usage since the last run on top of a stored running total
+# Days older than trailing_days are settled, their total and the last settled day are stored
+# Days since are fetched (and summed) again every run to pick up records that arrive late
+# Returns total, startDate, endDate
+async def usage_incremental(subscription, params, headers, credential):
+    (periodStart, periodEnd) = await billing_period(subscription, headers, credential)
+
+    # Start over when we roll into a new billing period
+    state = await asyncio.to_thread(store.get, 'azure', subscription)
+    # Or when the running total was summed from another measure
+    if state is None or state['period'] != periodStart[:10] or state.get('cost') != usage_cost:
+        state = {
+            'period': periodStart[:10],
+            'cost': usage_cost,
+            'through': None,
+            'settled': 0,
+            'startDate': None,
+            'endDate': None,
+        }
+
+    # Only ask for the days we haven't settled yet
+    params = dict(params)
+    since = periodStart[:10]
+    if state['through']:
+        since = (date.fromisoformat(state['through']) + timedelta(days=1)).isoformat()
+    params['$filter'] = f"properties/usageStart ge '{since}' and properties/usageEnd le '{periodEnd[:10]}'"
+
+    cutoff = (datetime.utcnow().date() - timedelta(days=trailing_days)).isoformat()
+
+    settled = state['settled']
+    recent = 0
+    async for i in usage_items(subscription, params, headers, credential):
+        props = i['properties']
+        if props['date'][:10] <= cutoff:
+            settled += props[usage_cost]
+        else:
+            recent += props[usage_cost]
+
+        # If we haven't grabbed the billing start and end dates do so now
+        if state['startDate'] is None:
+            state['startDate'] = props['servicePeriodStartDate']
+            state['endDate'] = props['servicePeriodEndDate']
+
+    # Nothing is settled until the window has moved past the start of the period
+    if cutoff >= since:
+        state['through'] = cutoff
+        state['settled'] = settled
+        await asyncio.to_thread(store.put, 'azure', subscription, state)
+    return settled + recent, state['startDate'], state['endDate']
+
+# Current billing period of the subscription, as (start, end) both inclusive
+# Falls back on the calendar month if the subscription has no billing periods (ie MCA)
+async def billing_period(subscription, headers, credential):
+    x = await ahttpclient.get(period_endpoint.format(subscriptionId=subscription), headers=headers)
+    if x.status_code == 401:
+        failed(x, credential)
+    if x.ok and (periods := json.loads(x.text)['value']):
+        # Newest period first
+        props = periods[0]['properties']
+        return props['billingPeriodStartDate'], props['billingPeriodEndDate']
+
+    today = datetime.today()
+    return today.strftime('%Y-%m-01'), (today+relativedelta(day=31)).strftime('%Y-%m-%d')
+
+# Ask cost management for the total cost of scope between start and end (inclusive)
+# group is a dimension to group by (ie SubscriptionId)
+# Returns {group value (lower case) or None: total in USD}
+async def query_total(scope, start, end, headers, credential, group=None) -> dict:
+    payload = {
+        'type': 'ActualCost',
+        'timeframe': 'Custom',
+        'timePeriod': {
+            'from': f'{start[:10]}T00:00:00Z',
+            'to': f'{end[:10]}T23:59:59Z',
+        },
+        'dataset': {
+            'granularity': 'None',
+            'aggregation': {
+                'totalCost': {'name': query_cost, 'function': 'Sum'},
+            },
+        },
+    }
+    if group:
+        payload['dataset']['grouping'] = [{'type': 'Dimension', 'name': group}]
+
+    totals = {}
+    url = query_endpoint.format(scope=scope)
+    # Rows page like everything else, though it takes a lot of groups to get there
+    while url:
+        x = await ahttpclient.post(url, headers=headers, json=payload)
+        if not x.ok:
+            failed(x, credential)
+        js = json.loads(x.text)['properties']
+
+        # Rows are lists in the order of columns, find the ones we want
+        columns = [c['name'] for c in js['columns']]
+        for row in js['rows']:
+            row = dict(zip(columns, row))
+            key = str(row[group]).lower() if group else None
+            totals[key] = totals.get(key, 0) + row['totalCost']
+        url = js.get('nextLink')
+    return totals
+
+# Totals for every subscription under a billing account, one query per billing account per run
+# Keyed by billing account, period and credential each with its own lock so
+# subscriptions running concurrently wait on the one query. Only touched on aio's loop
+billing_cache = {}
+
+async def billing_account_costs(billing_account, start, end, headers, credential) -> dict:
+    key = (billing_account, start, end, hashlib.sha256(json.dumps(credential).encode()).hexdigest())
+    if key not in billing_cache:
+        billing_cache[key] = {'lock': asyncio.Lock(), 'costs': None}
+    entry = billing_cache[key]
+
+    async with entry['lock']:
+        # Nothing stored if a previous attempt failed, so we just try again
+        if entry['costs'] is None:
+            entry['costs'] = await query_total(f'/providers/Microsoft.Billing/billingAccounts/{billing_account}',
+                                         start, end, headers, credential, group='SubscriptionId')
+        return entry['costs']
+
+# Raise for a failed usage call, dropping our token if it was rejected
+def failed(x, credential):
+    # Token was rejected, make sure the next call authenticates again
+    if x.status_code == 401:
+        tokens.invalidate('azure', credential)
+    raise Exception(f'API Call Failed:\n{json.loads(x.text)}')
+
+# Yields usage items loading every page in full, this is what we used to do
+# Kept to verify the streaming path against
+async def usage_pages(next_url, headers, credential):
     # We loop here to handle pagination
     while next_url is not None:
         # We already appended the parameters above
-        x = requests.get(next_url, headers=headers)
-        js = json.loads(x.text)
+        x = await ahttpclient.get(next_url, headers=headers)
         if not x.ok:
-            raise Exception(f'API Call Failed:\n{json.loads(x.text)}')
+            failed(x, credential)
+        js = json.loads(x.text)
 
-        # Loop through the returned itemized JSON and total
-        [total := total + i['properties']['paygCostInUSD'] for i in js['value']]
-        
-        # If we haven't grabbed the billing start and end dates do so now
-        if startDate is None and js['value']:
-            startDate = js['value'][0]['properties']['servicePeriodStartDate']
-            endDate = js['value'][0]['properties']['servicePeriodEndDate']
+        for item in js['value']:
+            yield item
 
         # Check if there is another page
         if 'nextLink' in js.keys():
@@ -71,8 +307,76 @@ def cost(account_name, password, subscription, client_id, tenant_id) -> "list[Co
             # Nope break the loop
             break
 
-    # Return a list of namedtuple CostItem()
-    ret = [
-        CostItem(total, startDate, endDate),
-    ]
-    return ret
\ No newline at end of file
+# Downloads pages into queue, as soon as a page is off the wire it follows the page's nextLink,
+# so the next page is on its way while the parser works. Cancelled once the parser stops listening
+# Puts ('chunk', bytes), ('end', url of the page it went on to or None) or ('error', response or exception)
+async def download(url, headers, queue):
+    try:
+        while url is not None:
+            async with ahttpclient.stream('GET', url, headers=headers) as x:
+                if not x.ok:
+                    await x.read()
+                    await queue.put(('error', x))
+                    return
+
+                # Keep the end of the page around, that's where nextLink is
+                tail = b''
+                async for chunk in x.iter_content(chunk_size):
+                    await queue.put(('chunk', chunk))
+                    tail = (tail + chunk)[-tail_size:]
+
+            link = trailing_link.search(tail)
+            url = json.loads(link.group(1)) if link else None
+            await queue.put(('end', url))
+    except asyncio.CancelledError:
+        raise
+    except Exception as err:
+        await queue.put(('error', err))
+
+# Yields usage items streaming each page through the parser while the next one downloads
+# Only a single usage item is ever parsed into memory at a time
+async def usage_stream(next_url, headers, credential):
+    # Hands the parser the chunks of the current page, stores where the downloader went next
+    prefetched = None
+    async def chunks(queue):
+        nonlocal prefetched
+        while True:
+            (kind, data) = await queue.get()
+            # get() doesn't give up the loop while there's something queued, do so
+            # anyway so the downloader gets on with the next page while we parse
+            await asyncio.sleep(0)
+            if kind == 'chunk':
+                yield data
+            elif kind == 'end':
+                prefetched = data
+                return
+            elif isinstance(data, BaseException):
+                raise data
+            else:
+                failed(data, credential)
+
+    queue = None
+    downloader = None
+    try:
+        while next_url is not None:
+            # Start downloading unless the downloader is already on this page
+            if downloader is None or prefetched != next_url:
+                if downloader is not None:
+                    downloader.cancel()
+                queue = asyncio.Queue(prefetch_chunks)
+                downloader = asyncio.create_task(download(next_url, headers, queue))
+
+            page = chunks(queue)
+            rest = {}
+            async for item in jsonstream.aiterarray(page, 'value', rest):
+                yield item
+            # Drain anything after the closing brace so we pick up where the downloader went
+            async for _ in page:
+                pass
+
+            # Check if there is another page
+            next_url = rest.get('nextLink')
+    finally:
+        # Stop the downloader if we bailed out early
+        if downloader is not None:
+            downloader.cancel()
@@ -11,4 +11,22 @@ CostItem = namedtuple("CostItem", "cost startDate endDate balance", defaults=(No
 """
 def cost(account_name) -> "list[CostItem]":
     return [CostItem("0.15", "YYYY-MM-DD", "YYYY-MM-DD")]
-"""
\ No newline at end of file
+"""
+
+# Providers spending their time waiting on the network may also implement acost(), an async
+# variant taking the same parameters and returning the same list of CostItems
+# cloudcost.py then runs the provider's accounts as tasks on one event loop (see providers.common.aio)
+# instead of a thread each. cost() is still required, it can just run acost() on that loop
+# Likewise an optional life() may come with an async alife()
+# Ex:
+"""
+from providers.common import aio
+from providers.common import ahttpclient
+
+def cost(account_name) -> "list[CostItem]":
+    return aio.run(acost(account_name))
+
+async def acost(account_name) -> "list[CostItem]":
+    x = await ahttpclient.get(url)
+    return [CostItem(x.json()['total'], "YYYY-MM-DD", "YYYY-MM-DD")]
+"""
@@ -1,12 +1,17 @@
-import requests
 import json
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
+from dateutil.parser import parse
 
 from providers.base import CostItem
+from providers.common import httpclient
+from providers.common import store
 
 endpoint = 'https://ruh.cloudsigma.com/api/2.0'
 
+# Ledger entries fetched per request
+page_size = 500
+
 def cost(account_name, password) -> 'list[CostItem]':
     # Some date magic
     # Just first of this month, Start is inclusive
@@ -25,42 +30,54 @@ def cost(account_name, password) -> 'list[CostItem]':
     }
 
     # First retrieve our account balance
-    x = requests.get(f'{endpoint}/balance', headers=headers, auth=auth)
+    x = httpclient.get(f'{endpoint}/balance', headers=headers, auth=auth)
     if not x.ok:
         raise Exception(f'failed to retreive balance {x}')
     js = json.loads(x.text)
     balance = f"{round(float(js['balance']),2):.2f} USD"
 
     
+    # We keep a running total of the month in the store along with the time of the newest
+    # ledger entry counted, and the ids of entries at that time since the next run picks up from it
+    key = f'{endpoint}/{account_name}'
+    month = first_day[:7]
+    state = store.get('cloudsigma', key)
+    # Start over every month
+    if state is None or state['month'] != month:
+        state = {'month': month, 'time': None, 'ids': [], 'total': 0}
+
     # Query parameters, filter by what we want
-    # our first request we want nothing returned, we simply want the total count that our query returns
     params = {
-        'time__gt': first_day,
         'time__lt': last_day,
-        'limit': 0
     }
+    if state['time']:
+        params['time__gte'] = state['time']
+    else:
+        params['time__gt'] = first_day
 
-    # Do the thing
-    x = requests.get(f'{endpoint}/ledger', headers=headers, auth=auth, params=params)
-    if not x.ok:
-        raise Exception(f'failed to retreive monthly usage {x}')
-    js = json.loads(x.text)
+    # Loop through the returned itemized JSON and total
+    total = float(state['total'])
+    counted = set(state['ids'])
+    latest = state['time']
+    seen = set(counted)
+    for i in ledger(headers, auth, params):
+        # Already counted on a previous run
+        if i['id'] in counted:
+            continue
+        # We only care about > 0 amounts for this since negative are us adding to the balance
+        total += float(i['amount']) if float(i['amount']) > 0 else 0
 
-    # Set the limit for our next request, grab everything
-    params['limit'] = js['meta']['total_count']
+        # Track the newest entry (and everything sharing its time)
+        if latest is None or parse(i['time']) > parse(latest):
+            latest = i['time']
+            seen = {i['id']}
+        elif parse(i['time']) == parse(latest):
+            seen.add(i['id'])
 
-    # Do the thing
-    x = requests.get(f'{endpoint}/ledger', headers=headers, auth=auth, params=params)
-    if not x.ok:
-        raise Exception(f'failed to retreive monthly usage {x}')
-    js = json.loads(x.text)
-
-    
-    # Loop through the returned itemized JSON and total
-    total = float(0)
-    # We only care about > 0 amounts for this since negative are us adding to the balance
-    # List comprehension is great
-    [total := total + (float(i['amount']) if float(i['amount']) > 0 else 0) for i in js['objects']]
+    state['total'] = total
+    state['time'] = latest
+    state['ids'] = sorted(seen) if latest else []
+    store.put('cloudsigma', key, state)
 
     return [
         CostItem(
@@ -69,4 +86,21 @@ def cost(account_name, password) -> 'list[CostItem]':
             last_day,
             balance
         )
-    ]
\ No newline at end of file
+    ]
+
+# Yields ledger entries matching params a page at a time
+def ledger(headers, auth, params):
+    params = dict(params, limit=page_size, offset=0)
+    while True:
+        # Do the thing
+        x = httpclient.get(f'{endpoint}/ledger', headers=headers, auth=auth, params=params)
+        if not x.ok:
+            raise Exception(f'failed to retreive monthly usage {x}')
+        js = json.loads(x.text)
+
+        yield from js['objects']
+
+        # Last page
+        if not js['objects'] or not js['meta'].get('next'):
+            return
+        params['offset'] += len(js['objects'])
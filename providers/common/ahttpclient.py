@@ -0,0 +1,165 @@
+import time
+import json
+import contextlib
+
+from providers.common import aio
+from providers.common import httpclient
+
+# Async counterpart of httpclient for providers implementing acost(), backed by aiohttp
+# One session on aio's loop pools connections for every async provider, an account waiting on a
+# response costs a task rather than a thread, so thousands can be in flight at once
+# Timeouts, retries and hooks (ie metrics) are shared with httpclient, responses look like requests'
+# aiohttp itself is only imported once a request is made
+
+# Connections open at once in total and per host
+limit = 1000
+limit_per_host = 100
+
+# Statuses request() tries again, up to httpclient.retries times, the server is busy or briefly broken
+retry_statuses = (429, 500, 502, 503, 504)
+
+# Longest we wait before trying again, whatever Retry-After asks for
+max_backoff = 60
+
+session = None
+
+# Called from cloudcost.py with the [http] config section
+def configure(section):
+    global limit, limit_per_host, session
+    limit = int(section.get('async_limit', limit))
+    limit_per_host = int(section.get('async_limit_per_host', limit_per_host))
+    session = None
+
+# What providers use of a requests.Response, content is None for a stream() until read
+class Response:
+    def __init__(self, response, content=None):
+        self.response = response
+        self.status_code = response.status
+        self.headers = response.headers
+        self.url = str(response.url)
+        self.content = content
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.response.charset or 'utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+    async def read(self) -> bytes:
+        if self.content is None:
+            self.content = await self.response.read()
+        return self.content
+
+    # Async iterator over the body of a stream(), chunk_size bytes at a time
+    def iter_content(self, chunk_size):
+        return self.response.content.iter_chunked(chunk_size)
+
+# Returns the shared session, creating it on first use. Must be called on aio's loop
+def get_session() -> "aiohttp.ClientSession":
+    global session
+    if session is None:
+        import aiohttp
+        (connect, read) = httpclient.timeout
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host),
+            timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read),
+            # The session is shared by every account, a cookie one sets must not be sent for the next
+            cookie_jar=aiohttp.DummyCookieJar(),
+        )
+    return session
+
+async def close():
+    global session
+    if session is not None:
+        await session.close()
+        session = None
+
+aio.at_close(close)
+
+# requests style arguments to aiohttp's
+def arguments(kwargs) -> dict:
+    import aiohttp
+    if isinstance(kwargs.get('auth'), tuple):
+        kwargs['auth'] = aiohttp.BasicAuth(*kwargs['auth'])
+    if isinstance(kwargs.get('timeout'), tuple):
+        (connect, read) = kwargs['timeout']
+        kwargs['timeout'] = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+    return kwargs
+
+# Open a request and hand over the response once the headers are in, the body is read with
+# iter_content() or read() inside the block. Hooks are called once the block is done
+@contextlib.asynccontextmanager
+async def stream(method, url, **kwargs):
+    start = time.perf_counter()
+    x = None
+    try:
+        async with attempt(method, url, **kwargs) as x:
+            yield x
+    finally:
+        report(method, url, x, start)
+
+# One try at a request, without the hooks so request() reports its retries as one request
+@contextlib.asynccontextmanager
+async def attempt(method, url, **kwargs):
+    async with get_session().request(method, url, **arguments(kwargs)) as r:
+        yield Response(r)
+
+def report(method, url, x, start, retries=0):
+    elapsed = time.perf_counter() - start
+    for hook in httpclient.hooks:
+        hook(method, url, x, elapsed, retries)
+
+# Seconds to wait before the attempt'th retry of a request, x is the response that failed if there was one
+# Retry-After is honoured when the server sends it, otherwise we back off exponentially with some jitter
+def backoff(attempt, x=None) -> float:
+    import random
+    after = x.headers.get('Retry-After') if x is not None else None
+    if after:
+        try:
+            return min(max(float(after), 0), max_backoff)
+        except ValueError:
+            pass
+        # Or an HTTP date
+        try:
+            import email.utils
+            return min(max(email.utils.parsedate_to_datetime(after).timestamp() - time.time(), 0), max_backoff)
+        except (TypeError, ValueError):
+            pass
+    return min(0.5 * 2 ** (attempt - 1), max_backoff) * random.uniform(0.5, 1.5)
+
+# Make a request and read the response. Failed connects and the retry_statuses are tried again
+# httpclient.retries times, after that the last response (or error) is what the caller gets
+# Like urllib3's retries for httpclient, the hooks see one request along with how often it was retried
+async def request(method, url, **kwargs) -> Response:
+    import asyncio
+    import aiohttp
+    start = time.perf_counter()
+    retries = 0
+    x = None
+    try:
+        while True:
+            x = None
+            try:
+                async with attempt(method, url, **kwargs) as x:
+                    await x.read()
+                if x.status_code not in retry_statuses or retries >= httpclient.retries:
+                    return x
+            # A stale pooled connection the server already closed counts as a failed connect
+            except (aiohttp.ClientConnectorError, aiohttp.ServerDisconnectedError):
+                if retries >= httpclient.retries:
+                    raise
+            retries += 1
+            await asyncio.sleep(backoff(retries, x))
+    finally:
+        report(method, url, x, start, retries)
+
+async def get(url, **kwargs) -> Response:
+    return await request('GET', url, **kwargs)
+
+async def post(url, **kwargs) -> Response:
+    return await request('POST', url, **kwargs)
@@ -0,0 +1,80 @@
+import atexit
+import weakref
+import threading
+import contextvars
+
+# The one event loop async providers (acost()/alife(), see providers/base.py) run on
+# It runs in a background thread, so synchronous callers (a ported provider's cost(), the bench,
+# cloudcost.py's driver) just hand it coroutines. Being the only loop, the asyncio locks and
+# semaphores providers share between accounts, and the aiohttp session, all live on it
+# asyncio is only imported once the loop is first needed, it's slow to import for commands that never use it
+
+loop_ = None
+thread = None
+lock = threading.Lock()
+
+# Functions called on the loop (as coroutines) before it's stopped at exit, ie to close sessions
+closers = []
+
+# Context each task on the loop runs in, so other threads (the profiler) can tell what it works for
+contexts = weakref.WeakKeyDictionary()
+
+# Returns the loop, starting it on first use
+def loop() -> "asyncio.AbstractEventLoop":
+    global loop_, thread
+    with lock:
+        if loop_ is None:
+            import asyncio
+            loop_ = asyncio.new_event_loop()
+            loop_.set_task_factory(task)
+            thread = threading.Thread(target=loop_.run_forever, name='aio', daemon=True)
+            thread.start()
+            atexit.register(stop)
+        return loop_
+
+# Task factory of the loop, a task copies its creator's context (ie metrics labels) as usual
+def task(loop, coro, context=None):
+    import asyncio
+    if context is None:
+        context = contextvars.copy_context()
+    t = asyncio.Task(coro, loop=loop, context=context)
+    contexts[t] = context
+    return t
+
+# Context of the task running on the loop right now, None between tasks. Callable from any thread
+def running_context():
+    import asyncio
+    if loop_ is None:
+        return None
+    t = asyncio.current_task(loop_)
+    return contexts.get(t) if t is not None else None
+
+def on_loop() -> bool:
+    return thread is not None and threading.current_thread() is thread
+
+# Schedule coro on the loop, returns a concurrent.futures.Future of its result
+def submit(coro):
+    import asyncio
+    return asyncio.run_coroutine_threadsafe(coro, loop())
+
+# Run coro on the loop and wait for its result, from any thread but the loop's own
+def run(coro):
+    if on_loop():
+        coro.close()
+        raise Exception('aio.run() called on the event loop, await the coroutine instead')
+    return submit(coro).result()
+
+# Register an async function to await before the loop stops
+def at_close(func):
+    closers.append(func)
+
+def stop():
+    if loop_ is None or not loop_.is_running():
+        return
+    for func in closers:
+        try:
+            run(func())
+        except Exception as err:
+            print(f'Failed to close {func.__qualname__}: {err}')
+    loop_.call_soon_threadsafe(loop_.stop)
+    thread.join(5)
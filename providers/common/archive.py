@@ -0,0 +1,119 @@
+import os
+import gzip
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+
+from providers.common import store
+
+# On disk cache of documents that never change once issued, closed invoices and their items
+# so each is downloaded once in its lifetime instead of every run
+# Documents are gzipped and stored by the sha256 of their content under objects/, refs/ maps
+# (provider, account, id) to the document. Least recently used documents are evicted past max_size
+
+# Where the archive lives, default archive/ under the store's path
+path = None
+
+# Bytes kept on disk before evicting, compressed size
+max_size = 256 * 1024 * 1024
+
+# Bytes the archive takes on disk, counted on the first put
+used = None
+lock = threading.Lock()
+
+# Called from cloudcost.py with the [archive] config section
+def configure(section):
+    global path, max_size, used
+    if 'path' in section:
+        path = Path(section['path'])
+    # In MB in the config file
+    max_size = int(float(section.get('max_size', max_size / 1024 / 1024)) * 1024 * 1024)
+    used = None
+
+def root() -> Path:
+    return path if path is not None else store.path / 'archive'
+
+def ref(provider, account, id) -> Path:
+    return root() / 'refs' / provider / f"{store.digest(f'{account}/{id}')}"
+
+def obj(digest) -> Path:
+    return root() / 'objects' / digest[:2] / f'{digest}.gz'
+
+# Write data to file without ever leaving half a file behind
+def write(file, data):
+    file.parent.mkdir(parents=True, exist_ok=True)
+    (fd, tmp) = tempfile.mkstemp(dir=file.parent, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, file)
+
+# Returns the archived document as bytes, None if we don't have it
+def get(provider, account, id):
+    r = ref(provider, account, id)
+    try:
+        digest = r.read_text()
+        o = obj(digest)
+        data = gzip.decompress(o.read_bytes())
+    except (OSError, EOFError):
+        return None
+    # Evicted or damaged documents are just downloaded again
+    if hashlib.sha256(data).hexdigest() != digest:
+        return None
+    # Mark it used so eviction keeps it
+    os.utime(o)
+    return data
+
+def put(provider, account, id, data):
+    global used
+    digest = hashlib.sha256(data).hexdigest()
+    with lock:
+        if used is None:
+            evict()
+        o = obj(digest)
+        if not o.exists():
+            compressed = gzip.compress(data)
+            write(o, compressed)
+            used += len(compressed)
+        write(ref(provider, account, id), digest.encode())
+        if used > max_size:
+            evict()
+
+# Drop least recently used documents until we're under max_size, and recount used. Must hold lock
+def evict():
+    global used
+    objects = []
+    for o in (root() / 'objects').glob('*/*.gz'):
+        try:
+            st = o.stat()
+        except FileNotFoundError:
+            continue
+        objects.append((st.st_mtime, st.st_size, o))
+
+    total = sum(size for (_, size, _) in objects)
+    for (_, size, o) in sorted(objects):
+        if total <= max_size:
+            break
+        try:
+            o.unlink()
+        except FileNotFoundError:
+            pass
+        total -= size
+    used = total
+
+# Returns the archived document, calling download() (which must return bytes) only if we don't have it
+def fetch(provider, account, id, download) -> bytes:
+    data = get(provider, account, id)
+    if data is None:
+        data = download()
+        put(provider, account, id, data)
+    return data
+
+# fetch() for async providers, download is an async function, the disk work runs off the loop
+async def afetch(provider, account, id, download) -> bytes:
+    import asyncio
+    data = await asyncio.to_thread(get, provider, account, id)
+    if data is None:
+        data = await download()
+        await asyncio.to_thread(put, provider, account, id, data)
+    return data
@@ -0,0 +1,86 @@
+import hmac
+import json
+import hashlib
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, quote
+
+from providers.common import httpclient
+
+# Minimal in-process AWS client, saves spawning the aws cli (and its interpreter) per call
+# Requests are signed with signature version 4
+# https://docs.aws.amazon.com/general/latest/gr/sigv4_signing.html
+
+# Cost Explorer only lives in us-east-1
+# Override endpoint to point at a local stub (see bench/) for testing offline
+ce_region = 'us-east-1'
+ce_endpoint = 'https://ce.us-east-1.amazonaws.com/'
+
+def sha256(data) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def hmac_sha256(key, msg) -> bytes:
+    return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+# Returns the headers needed to sign a request, Authorization and X-Amz-Date
+# headers are any headers we're sending that should be signed, host is added here
+def sign(method, url, region, service, access_key_id, secret_access_key, headers, body=b'', now=None) -> dict:
+    now = now or datetime.now(timezone.utc)
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    date = now.strftime('%Y%m%d')
+
+    parts = urlsplit(url)
+    headers = {k.lower(): str(v).strip() for (k,v) in headers.items()}
+    headers['host'] = parts.netloc
+    headers['x-amz-date'] = amz_date
+
+    # Query parameters sorted and encoded, our calls don't use any but be correct anyway
+    query = '&'.join(sorted(
+        '='.join(quote(p, safe='-_.~') for p in (q.split('=', 1) + [''])[:2])
+        for q in parts.query.split('&') if q
+    ))
+
+    signed_headers = ';'.join(sorted(headers))
+    canonical_request = '\n'.join([
+        method,
+        quote(parts.path or '/', safe='/-_.~'),
+        query,
+        ''.join(f'{k}:{headers[k]}\n' for k in sorted(headers)),
+        signed_headers,
+        sha256(body),
+    ])
+
+    scope = f'{date}/{region}/{service}/aws4_request'
+    string_to_sign = '\n'.join([
+        'AWS4-HMAC-SHA256',
+        amz_date,
+        scope,
+        sha256(canonical_request.encode('utf-8')),
+    ])
+
+    # Derive the signing key from the secret, date, region and service
+    key = ('AWS4' + secret_access_key).encode('utf-8')
+    for part in (date, region, service, 'aws4_request'):
+        key = hmac_sha256(key, part)
+    signature = hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    return {
+        'X-Amz-Date': amz_date,
+        'Authorization': f'AWS4-HMAC-SHA256 Credential={access_key_id}/{scope}, '
+                         f'SignedHeaders={signed_headers}, Signature={signature}',
+    }
+
+# Call a Cost Explorer action (ie GetCostAndUsage) with a json payload
+# Returns the parsed json response, raises if the call failed
+def ce(action, payload, access_key_id, secret_access_key) -> dict:
+    body = json.dumps(payload).encode('utf-8')
+    headers = {
+        'Content-Type': 'application/x-amz-json-1.1',
+        'X-Amz-Target': f'AWSInsightsIndexService.{action}',
+    }
+    headers.update(sign('POST', ce_endpoint, ce_region, 'ce', access_key_id, secret_access_key, headers, body))
+
+    x = httpclient.post(ce_endpoint, headers=headers, data=body)
+    js = json.loads(x.text)
+    if not x.ok:
+        raise Exception(f'{action} failed:\n{json.dumps(js,indent=4)}')
+    return js
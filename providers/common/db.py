@@ -0,0 +1,43 @@
+import threading
+
+# Postgres connection for the providers' own state (store, rates)
+# We open our own autocommit connection so we never commit in the middle of cloudcost.py's transaction
+# psycopg2 is only imported once something actually uses it
+
+# Connection parameters, the [database] config section
+database = None
+
+conn = None
+lock = threading.Lock()
+
+# Called from cloudcost.py with the [database] config section
+def configure(section):
+    global database, conn
+    with lock:
+        database = dict(section)
+        conn = None
+
+# Returns our connection, connecting on first use. Must hold lock
+def connection():
+    global conn
+    import psycopg2
+    if conn is None:
+        if database is None:
+            raise Exception('No [database] config section to connect with')
+        conn = psycopg2.connect(**database)
+        conn.autocommit = True
+    return conn
+
+# Run query, returns every row if it returns any
+def execute(query, params=None) -> list:
+    with lock:
+        with connection().cursor() as cur:
+            cur.execute(query, params)
+            return cur.fetchall() if cur.description else []
+
+# Insert many rows at once, query has a single VALUES %s placeholder
+def execute_values(query, rows):
+    import psycopg2.extras
+    with lock:
+        with connection().cursor() as cur:
+            psycopg2.extras.execute_values(cur, query, rows, page_size=1000)
@@ -0,0 +1,81 @@
+import time
+import threading
+
+# Shared HTTP client for the providers
+# Drop in for requests.get/post/request, except every call goes through one Session
+# so connections are kept alive and pooled per host, and every call has a timeout
+# requests itself is only imported once a request is made, the CLI loads us for commands that never make one
+
+# Number of hosts we keep a pool for, and connections kept per host
+pool_connections = 32
+pool_maxsize = 16
+
+# Default (connect, read) timeout in seconds, a call can still pass its own
+timeout = (10, 120)
+
+# Number of times urllib3 retries failed connects, 0 keeps the old requests behaviour
+# ahttpclient also retries 429 and 5xx responses this many times
+retries = 0
+
+# Called after every request with (method, url, response, elapsed seconds, retries)
+# response is None if the request never got one (timeout, connection refused...)
+# retries is how many times the request was tried again before response
+hooks = []
+
+session = None
+lock = threading.Lock()
+
+# Change pool sizes/timeouts, called from cloudcost.py with the [http] config section
+# Drops the current session so the next request picks up the new settings
+def configure(section):
+    global pool_connections, pool_maxsize, timeout, retries, session
+    pool_connections = int(section.get('pool_connections', pool_connections))
+    pool_maxsize = int(section.get('pool_maxsize', pool_maxsize))
+    timeout = (float(section.get('connect_timeout', timeout[0])), float(section.get('read_timeout', timeout[1])))
+    retries = int(section.get('retries', retries))
+    with lock:
+        session = None
+
+# Register a function to be called after every request
+def add_hook(hook):
+    hooks.append(hook)
+
+# Returns the shared session, creating it on first use
+def get_session() -> "requests.Session":
+    global session
+    with lock:
+        if session is None:
+            import http.cookiejar
+            import requests
+            from requests.adapters import HTTPAdapter
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retries)
+            s.mount('https://', adapter)
+            s.mount('http://', adapter)
+            # requests does this by default, but be explicit since providers depend on it
+            s.headers['Accept-Encoding'] = 'gzip, deflate'
+            # The session is shared by every account, a cookie one sets must not be sent for the next
+            s.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+            session = s
+        return session
+
+def request(method, url, **kwargs) -> "requests.Response":
+    kwargs.setdefault('timeout', timeout)
+    start = time.perf_counter()
+    x = None
+    try:
+        x = get_session().request(method, url, **kwargs)
+        return x
+    finally:
+        elapsed = time.perf_counter() - start
+        # urllib3 keeps the retries it made on the raw response
+        history = getattr(getattr(x, 'raw', None), 'retries', None)
+        retried = len(history.history) if history is not None else 0
+        for hook in hooks:
+            hook(method, url, x, elapsed, retried)
+
+def get(url, **kwargs) -> "requests.Response":
+    return request('GET', url, **kwargs)
+
+def post(url, **kwargs) -> "requests.Response":
+    return request('POST', url, **kwargs)
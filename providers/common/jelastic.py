@@ -1,12 +1,36 @@
-import requests
 import json
+import asyncio
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
-from currency_converter import CurrencyConverter
 
 from providers.base import CostItem
+from providers.common import aio
+from providers.common import ahttpclient
+from providers.common import rates
+
+# Our Jelastic accounts are numerous but small, latency not payload is what costs us
+# So both calls of an account go out at once, and many accounts run side by side per host
+# Requests in flight per host
+host_limit = 8
+
+# Accounts of one host in flight, used by the providers as their concurrency
+# Waiting on the host's slots only costs a task, so plenty can queue up while host_limit protects the host
+account_limit = 256
+
+# One semaphore per host capping requests in flight, on aio's loop
+host_slots = {}
+
+# GET against a Jelastic host once it has a free slot, waiting on one holds no thread
+async def get(endpoint, url, headers, params):
+    if endpoint not in host_slots:
+        host_slots[endpoint] = asyncio.Semaphore(host_limit)
+    async with host_slots[endpoint]:
+        return await ahttpclient.get(url, headers=headers, params=params)
 
 def cost(endpoint, currency, account_name, api_key) -> "list[CostItem]":
+    return aio.run(acost(endpoint, currency, account_name, api_key))
+
+async def acost(endpoint, currency, account_name, api_key) -> "list[CostItem]":
 
     billing_endpoint = f"{endpoint}/1.0/billing/account/rest/getaccountbillinghistorybyperiod"
     account_endpoint = f"{endpoint}/1.0/billing/account/rest/getaccount"
@@ -30,8 +54,17 @@ def cost(endpoint, currency, account_name, api_key) -> "list[CostItem]":
         'period': 'MONTH',
     }
 
-    # Grab the extensive billing report
-    x = requests.get(billing_endpoint, headers=headers, params=data)
+    account_data = {
+        'appid': '1dd8d191d38fff45e62564fcf67fdcd6',
+        'session': api_key,
+    }
+
+    # Grab the extensive billing report and our account balance at the same time
+    (x, account) = await asyncio.gather(
+        get(endpoint, billing_endpoint, headers, data),
+        get(endpoint, account_endpoint, headers, account_data),
+    )
+
     js = json.loads(x.text)
     if not x.ok:
         raise Exception(f'getaccountbillinghistorybyperiod Failed\n{json.dumps(js,indent=4)}')
@@ -40,22 +73,17 @@ def cost(endpoint, currency, account_name, api_key) -> "list[CostItem]":
     # We need to add together cost for each item
     total = 0
     [total := total + i['cost'] for i in js['array']]
-    
-    # Grab our account balance
-    data = {
-        'appid': '1dd8d191d38fff45e62564fcf67fdcd6',
-        'session': api_key,
-    }
-    x = requests.get(account_endpoint, headers=headers, params=data)
+
+    x = account
     js = json.loads(x.text)
     if x.status_code != 200:
         raise Exception(f'getaccount failed\n{json.dumps(js,indent=4)}')
     # Grab balance do formatting here since we're special
     balance = f"{round(float(js['balance']),2):.2f} {currency}"
 
-    if currency != 'USD':
-        c = CurrencyConverter()
-        total = c.convert(total, currency, 'USD')
+    # The month is still running, so convert at today's rate
+    # Off the loop, the first conversion of a run loads the rate table
+    total = await asyncio.to_thread(rates.convert, total, currency, 'USD')
 
     # Generate our return list
     ret = [
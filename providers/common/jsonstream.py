@@ -0,0 +1,111 @@
+import re
+import json
+import codecs
+
+# Incremental parsing of big json documents shaped like {"value": [ ...huge... ], "nextLink": ...}
+# Only one array element is ever materialized at a time, so memory stays flat no matter the page size
+# The parser never reads on its own, it yields more when it needs the next chunk and is fed it,
+# so the same parser runs over a plain iterator of chunks (iterarray) or an async one (aiterarray)
+
+decoder = json.JSONDecoder()
+whitespace = re.compile(r'[ \t\n\r]*')
+
+# Yielded by the parser when it needs the next chunk
+more = object()
+
+# Buffers the text of the chunks fed so far. Its methods are generators yielding more until
+# they have enough text, use them with yield from
+class Reader:
+    def __init__(self):
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    # Add the next chunk, None at the end of the document, dropping what we've already parsed
+    def feed(self, chunk):
+        if chunk is None:
+            self.eof = True
+            text = self.utf8.decode(b'', final=True)
+        else:
+            text = self.utf8.decode(chunk)
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+
+    # Returns the next non whitespace character without consuming it, None at the end
+    def peek(self):
+        while True:
+            self.pos = whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                return None
+            yield more
+
+    # Consume the next non whitespace character, it must be one of expected
+    def expect(self, expected):
+        c = yield from self.peek()
+        if c is None or c not in expected:
+            raise json.JSONDecodeError(f'Expecting one of {expected!r}', self.buf, self.pos)
+        self.pos += 1
+        return c
+
+    # Parse the next complete json value
+    def value(self):
+        yield from self.peek()
+        while True:
+            try:
+                (obj, end) = decoder.raw_decode(self.buf, self.pos)
+                # A number (or literal) running up to the end of the buffer may carry on in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                # Most likely the value is cut off, only an error if there is no more to read
+                if self.eof:
+                    raise
+            yield more
+
+# Yields every element of the array under key of the top level object, and more whenever
+# reader needs feeding. Any other top level keys (ie nextLink) are stored in rest as they're found
+def parse(reader, key, rest):
+    yield from reader.expect('{')
+    if (yield from reader.peek()) == '}':
+        return
+    while True:
+        name = yield from reader.value()
+        yield from reader.expect(':')
+        if name == key:
+            yield from reader.expect('[')
+            if (yield from reader.peek()) == ']':
+                reader.pos += 1
+            else:
+                while True:
+                    yield (yield from reader.value())
+                    if (yield from reader.expect(',]')) == ']':
+                        break
+        else:
+            rest[name] = yield from reader.value()
+        if (yield from reader.expect(',}')) == '}':
+            return
+
+# Yields every element of the array under key of the top level object, reading an iterator of byte chunks
+# rest is complete once the generator is exhausted
+def iterarray(chunks, key, rest):
+    chunks = iter(chunks)
+    reader = Reader()
+    for item in parse(reader, key, rest):
+        if item is more:
+            reader.feed(next(chunks, None))
+        else:
+            yield item
+
+# iterarray() over an async iterator of byte chunks
+async def aiterarray(chunks, key, rest):
+    chunks = aiter(chunks)
+    reader = Reader()
+    for item in parse(reader, key, rest):
+        if item is more:
+            reader.feed(await anext(chunks, None))
+        else:
+            yield item
@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import functools
+import contextlib
+import contextvars
+from datetime import datetime, timezone
+
+from providers.common import aio
+from providers.common import db
+from providers.common import httpclient
+
+# Where the time of a run went: timing spans around the commands, each provider call and the
+# mattermost posts, plus HTTP requests, response bytes, retries and failures per provider and account
+# Exported at the end of the run to a node exporter textfile, a json summary and/or the runs table
+
+# node exporter textfile collector file to write, ie /var/lib/node_exporter/textfile_collector/cloudcost.prom
+textfile = None
+
+# json run summary to write
+summary = None
+
+# Keep every run's summary in the runs table in postgres (see schema.sql)
+persist = False
+
+# Provider and account whatever runs in this context is working for, HTTP requests are counted against them
+labels = contextvars.ContextVar('labels', default={})
+
+# Labels of whatever each thread is working on right now, by thread id, for the profiler
+# Not kept for aio's loop, its tasks take turns on the one thread (the profiler reads their stacks instead)
+active = {}
+
+spans = []
+http = {}
+lock = threading.Lock()
+started = datetime.now(timezone.utc)
+
+# Called from cloudcost.py with the [metrics] config section
+def configure(section):
+    global textfile, summary, persist
+    textfile = section.get('textfile', textfile)
+    summary = section.get('summary', summary)
+    persist = section.getboolean('persist', persist)
+
+def enabled() -> bool:
+    return bool(textfile or summary or persist)
+
+# Time the block as span name, provider/account labels also apply to HTTP requests made inside it
+@contextlib.contextmanager
+def span(name, **kwargs):
+    token = labels.set({**labels.get(), **kwargs})
+    current = labels.get()
+    start = time.perf_counter()
+    ok = False
+    try:
+        with marked(current):
+            yield
+        ok = True
+    finally:
+        elapsed = time.perf_counter() - start
+        labels.reset(token)
+        with lock:
+            spans.append({'name': name, 'provider': current.get('provider'), 'account': current.get('account'),
+                          'seconds': elapsed, 'ok': ok})
+
+# Returns func wrapped to run in a copy of the caller's context, for handing work to other threads
+# so whatever the caller set (ie labels) carries over to them
+def bind(func):
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(within, func, *args, **kwargs)
+    return run
+
+def within(func, *args, **kwargs):
+    with marked(labels.get()):
+        return func(*args, **kwargs)
+
+# Note current as what this thread works on for the duration
+@contextlib.contextmanager
+def marked(current):
+    if aio.on_loop():
+        yield
+        return
+    thread = threading.get_ident()
+    previous = active.get(thread)
+    active[thread] = current
+    try:
+        yield
+    finally:
+        if previous is None:
+            active.pop(thread, None)
+        else:
+            active[thread] = previous
+
+# Decorator form of span() for whole functions
+def timed(name):
+    def wrap(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return wrap
+
+# Bytes of the response body as providers see it, after any gzip is undone
+# A streamed body isn't read yet when the hook runs, for those we go by the Content-Length header
+def body_size(response) -> int:
+    # Looked up in the instance rather than through requests' content property, which would read a stream
+    # requests holds False there until the body is read, ahttpclient None
+    fields = vars(response)
+    content = fields.get('_content', fields.get('content'))
+    if isinstance(content, bytes):
+        return len(content)
+    return int(response.headers.get('Content-Length', 0))
+
+# httpclient hook, counts every request against the labels of the context making it
+def request_hook(method, url, response, elapsed, retries):
+    current = labels.get()
+    key = (current.get('provider'), current.get('account'))
+    with lock:
+        counts = http.setdefault(key, {'requests': 0, 'bytes': 0, 'retries': 0, 'failures': 0, 'seconds': 0})
+        counts['requests'] += 1
+        counts['seconds'] += elapsed
+        if response is None or not response.ok:
+            counts['failures'] += 1
+        if response is not None:
+            counts['bytes'] += body_size(response)
+        counts['retries'] += retries
+
+httpclient.add_hook(request_hook)
+
+def report(command) -> dict:
+    with lock:
+        return {
+            'command': command,
+            'started': started.isoformat(),
+            'finished': datetime.now(timezone.utc).isoformat(),
+            'spans': list(spans),
+            'http': [{'provider': p, 'account': a, **counts} for ((p, a), counts) in http.items()],
+        }
+
+# Prometheus label set, values escaped as the exposition format wants
+def promlabels(**kwargs) -> str:
+    def escape(v):
+        return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for (k, v) in kwargs.items() if v is not None) + '}'
+
+def prometheus(run) -> str:
+    lines = [
+        '# HELP cloudcost_run_timestamp_seconds When the last run finished',
+        '# TYPE cloudcost_run_timestamp_seconds gauge',
+        f'cloudcost_run_timestamp_seconds{promlabels(command=run["command"])} {time.time():.0f}',
+        '# HELP cloudcost_span_seconds Time spent in each span of the last run',
+        '# TYPE cloudcost_span_seconds gauge',
+    ]
+    # Spans of the same name and labels (ie retried posts) add up
+    totals = {}
+    for s in run['spans']:
+        key = promlabels(span=s['name'], provider=s['provider'], account=s['account'])
+        (seconds, failed) = totals.get(key, (0, 0))
+        totals[key] = (seconds + s['seconds'], failed + (not s['ok']))
+    lines += [f'cloudcost_span_seconds{key} {seconds:.6f}' for (key, (seconds, _)) in totals.items()]
+    lines += ['# HELP cloudcost_span_failures Spans of the last run that raised',
+              '# TYPE cloudcost_span_failures gauge']
+    lines += [f'cloudcost_span_failures{key} {failed}' for (key, (_, failed)) in totals.items()]
+
+    for (metric, help) in (('requests', 'HTTP requests made'), ('bytes', 'HTTP response bytes'),
+                           ('retries', 'HTTP retries'), ('failures', 'HTTP requests that failed'),
+                           ('seconds', 'Time spent in HTTP requests')):
+        lines += [f'# HELP cloudcost_http_{metric} {help} in the last run', f'# TYPE cloudcost_http_{metric} gauge']
+        lines += [f'cloudcost_http_{metric}{promlabels(provider=h["provider"], account=h["account"])} {h[metric]}'
+                  for h in run['http']]
+    return '\n'.join(lines) + '\n'
+
+# Write text to file swapping it in at once, the collector may read it at any moment
+def write(file, text):
+    directory = os.path.dirname(os.path.abspath(file))
+    (fd, tmp) = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, file)
+
+# Export what we've recorded, called once the command is done
+def export(command):
+    if not enabled():
+        return
+    run = report(command)
+    if textfile:
+        write(textfile, prometheus(run))
+    if summary:
+        write(summary, json.dumps(run, indent=4))
+    if persist:
+        db.execute('insert into runs (command, started, finished, summary) values (%s, %s, %s, %s);',
+                   (command, run['started'], run['finished'], json.dumps(run)))
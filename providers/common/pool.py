@@ -0,0 +1,70 @@
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from providers.common import metrics
+
+# Result of a single task handed to fan_out()
+# Exactly one of result or error is set, error holds the exception the task raised
+Outcome = namedtuple("Outcome", "result error", defaults=(None,) * 2)
+
+# Run func(*args) for every tuple in items on a bounded pool of threads
+# key(*args) groups tasks (ie by provider), limits caps how many tasks of a group
+# are in flight at once, groups not in limits are capped at default_limit
+# Returns a list of Outcome in the same order as items
+def fan_out(func, items, workers=8, key=None, limits=None, default_limit=None) -> "list[Outcome]":
+    return list(ifan_out(func, items, workers, key, limits, default_limit))
+
+# Same as fan_out() but yields each Outcome as soon as it and every one before it are done
+def ifan_out(func, items, workers=8, key=None, limits=None, default_limit=None):
+    items = list(items)
+    outcomes = [None] * len(items)
+    if not items:
+        return
+
+    # Queue the index of every task under its group
+    groups = {}
+    for i, args in enumerate(items):
+        groups.setdefault(key(*args) if key else None, deque()).append(i)
+
+    lock = threading.Lock()
+    done = threading.Condition(lock)
+
+    # Tasks run in a copy of the caller's context, so whatever it set (ie metrics labels) carries over
+    func = metrics.bind(func)
+
+    # A lane drains its group's queue one task at a time
+    # We start at most <limit> lanes per group which is what enforces the cap,
+    # lanes waiting on the executor don't hold a thread so the global bound still applies
+    def lane(queue):
+        while True:
+            with lock:
+                if not queue:
+                    return
+                i = queue.popleft()
+            try:
+                outcome = Outcome(func(*items[i]))
+            except BaseException as err:
+                outcome = Outcome(error=err)
+            with done:
+                outcomes[i] = outcome
+                done.notify_all()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for group, queue in groups.items():
+            limit = (limits or {}).get(group, default_limit) or len(queue)
+            for _ in range(min(max(1, limit), len(queue))):
+                pool.submit(lane, queue)
+
+        for i in range(len(items)):
+            with done:
+                done.wait_for(lambda: outcomes[i] is not None)
+            yield outcomes[i]
+
+# Ordered parallel map, raises the first error (in item order) if any task failed
+def pmap(func, items, workers=8) -> list:
+    outcomes = fan_out(func, [(i,) for i in items], workers)
+    for outcome in outcomes:
+        if outcome.error is not None:
+            raise outcome.error
+    return [outcome.result for outcome in outcomes]
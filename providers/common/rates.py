@@ -0,0 +1,110 @@
+import threading
+from datetime import date
+
+from providers.common import db
+
+# Process wide currency rate table, loaded once and shared by every provider reporting in something other than USD
+# Building a CurrencyConverter parses the whole ECB history, far too slow to do per account
+# Rates are dated so amounts convert at the rate of their billing period, dates past the
+# newest rate we have use the newest one
+
+# Where rates come from, the ECB history (csv or zip) as a local path or url
+# Default is the copy bundled with currency_converter, which is only as fresh as the package
+file = None
+
+# Keep rates in the currency_rates table in postgres (see schema.sql)
+# Rates loaded from file are saved there, and without a file they're loaded from there
+# so a host without network access still converts at the rates the last refresh saw
+persist = False
+
+converter = None
+lock = threading.Lock()
+
+# Called from cloudcost.py with the [rates] config section
+def configure(section):
+    global file, persist, converter
+    with lock:
+        file = section.get('file', file)
+        persist = section.getboolean('persist', persist)
+        converter = None
+
+# Read the ECB csv lines out of file, the same formats currency_converter accepts
+def read_lines(file) -> list:
+    from urllib.request import urlopen
+    from currency_converter.currency_converter import get_lines_from_zip
+    if file.startswith(('http://', 'https://')):
+        content = urlopen(file).read()
+    else:
+        with open(file, 'rb') as f:
+            content = f.read()
+    if file.endswith('.zip'):
+        return list(get_lines_from_zip(content))
+    return content.decode('utf-8').splitlines()
+
+# ECB csv lines to (date, currency, rate) rows
+def rows_from(lines) -> list:
+    header = [c.strip() for c in lines[0].strip().split(',')[1:]]
+    rows = []
+    for line in lines[1:]:
+        line = line.strip().split(',')
+        if not line[0]:
+            continue
+        day = date.fromisoformat(line[0])
+        for (currency, rate) in zip(header, line[1:]):
+            if currency and rate not in ('', 'N/A'):
+                rows.append((day, currency, float(rate)))
+    return rows
+
+# (date, currency, rate) rows back to ECB csv lines
+def lines_from(rows) -> list:
+    currencies = sorted({currency for (_, currency, _) in rows})
+    days = {}
+    for (day, currency, rate) in rows:
+        days.setdefault(day, {})[currency] = rate
+    lines = [','.join(['Date'] + currencies)]
+    for day in sorted(days, reverse=True):
+        lines.append(','.join([day.isoformat()] + [str(days[day].get(c, 'N/A')) for c in currencies]))
+    return lines
+
+# Only insert the days newer than what's already saved, a refresh is mostly days we already have
+def save(rows):
+    newest = db.execute('select max(date) from currency_rates;')[0][0]
+    rows = [r for r in rows if newest is None or r[0] > newest]
+    if rows:
+        db.execute_values('insert into currency_rates (date, currency, rate) values %s on conflict do nothing;', rows)
+
+def load():
+    from currency_converter import CurrencyConverter, CURRENCY_FILE
+    c = CurrencyConverter(None, fallback_on_wrong_date=True, fallback_on_missing_rate=True)
+
+    lines = None
+    saved = False
+    if file:
+        lines = read_lines(file)
+    elif persist:
+        rows = db.execute('select date, currency, rate from currency_rates;')
+        if rows:
+            lines = lines_from(rows)
+            saved = True
+    if lines is None:
+        # Nothing configured or saved yet, start from the bundled history
+        lines = read_lines(CURRENCY_FILE)
+
+    c.load_lines(lines)
+    if persist and not saved:
+        save(rows_from(lines))
+    return c
+
+# Returns the shared table, loading it on first use
+def table():
+    global converter
+    with lock:
+        if converter is None:
+            converter = load()
+        return converter
+
+# Convert amount from currency to to at the rate on day on (default today)
+def convert(amount, currency, to='USD', on=None):
+    if currency == to:
+        return amount
+    return table().convert(amount, currency, to, date=on or date.today())
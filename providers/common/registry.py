@@ -0,0 +1,144 @@
+import os
+import importlib
+import threading
+from pathlib import Path
+
+from providers.common import store
+
+# What every provider module takes and supports, read from its source rather than by importing it
+# so validating and listing providers never pays for their dependencies (ovh, dateutil, requests...)
+# The manifest is kept in the store under 'registry', an entry is rebuilt when its file's mtime or size changes
+# Modules are imported at most once per process through load()
+
+# Where the provider modules live
+directory = Path(__file__).resolve().parent.parent
+
+# Modules in directory that aren't providers
+skip = ('__init__', 'base')
+
+# Shared implementations providers are thin wrappers around
+backends = ('jelastic', 'softlayer')
+
+# Bump when what describe() records changes, older manifests are rebuilt
+version = 2
+
+manifest_cache = None
+modules = {}
+lock = threading.Lock()
+
+# Value of a module level assignment we can record without running it
+# Literals as they are, attributes of a providers.common module as 'module.attr', anything else None
+def static(node, common):
+    import ast
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id in common:
+        return f'{node.value.id}.{node.attr}'
+    return None
+
+# Manifest entry of one provider file
+def describe(file) -> dict:
+    # Only needed when a file changed, and slow enough to import to keep off the CLI's startup
+    import ast
+    with open(file) as f:
+        tree = ast.parse(f.read(), filename=str(file))
+
+    entry = {'fields': [], 'optional': [], 'life': False, 'configure': False, 'acost': False, 'alife': False,
+             'backend': None, 'concurrency': None}
+    common = set()
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name == 'cost':
+            args = [a.arg for a in node.args.args]
+            # The last len(defaults) arguments are optional
+            required = len(args) - len(node.args.defaults)
+            entry['fields'] = [a for a in args[:required] if a != 'account_name']
+            entry['optional'] = [a for a in args[required:] if a != 'account_name']
+        elif isinstance(node, ast.FunctionDef) and node.name in ('life', 'configure'):
+            entry[node.name] = True
+        elif isinstance(node, ast.AsyncFunctionDef) and node.name in ('acost', 'alife'):
+            entry[node.name] = True
+        elif isinstance(node, ast.ImportFrom) and node.module == 'providers.common':
+            common.update(a.name for a in node.names if a.asname is None)
+            shared = [a.name for a in node.names if a.name in backends]
+            entry['backend'] = entry['backend'] or (shared[0] if shared else None)
+        elif isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == 'concurrency' for t in node.targets):
+            # True when it's set to something we can't read statically, load() the module to find out
+            value = static(node.value, common)
+            entry['concurrency'] = True if value is None else value
+    return entry
+
+# {provider: entry} of every provider module, rebuilding the entries whose files changed
+def manifest() -> dict:
+    global manifest_cache
+    with lock:
+        if manifest_cache is not None:
+            return manifest_cache
+
+        # The manifest is only a shortcut, failing to read or save it costs us parsing the files again
+        try:
+            stored = store.get('registry', str(directory)) or {}
+        except Exception:
+            stored = {}
+        if stored.get('version') != version:
+            stored = {'version': version, 'providers': {}}
+
+        providers = {}
+        for f in os.scandir(directory):
+            (name, ext) = os.path.splitext(f.name)
+            if ext != '.py' or name in skip or not f.is_file():
+                continue
+            st = f.stat()
+            entry = stored['providers'].get(name)
+            if entry is None or entry['mtime'] != st.st_mtime_ns or entry['size'] != st.st_size:
+                entry = {**describe(f.path), 'mtime': st.st_mtime_ns, 'size': st.st_size}
+            providers[name] = entry
+
+        if providers != stored['providers']:
+            try:
+                store.put('registry', str(directory), {'version': version, 'providers': providers})
+            except Exception as err:
+                print(f'Failed to save the provider manifest: {err}')
+
+        manifest_cache = providers
+        return providers
+
+def names() -> list:
+    return sorted(manifest())
+
+def exists(provider) -> bool:
+    return provider in manifest()
+
+# Manifest entry of provider, raises if there's no such provider
+def get(provider) -> dict:
+    entry = manifest().get(provider)
+    if entry is None:
+        raise Exception(f'The provider {provider} does not have an implementation')
+    return entry
+
+# Whether provider implements the optional life(), configure(), acost() or alife()
+def supports(provider, func) -> bool:
+    return get(provider)[func]
+
+# Accounts of provider to run at once as the module asks for, default if it doesn't
+def concurrency(provider, default):
+    value = get(provider)['concurrency']
+    if value is None:
+        return default
+    if isinstance(value, str):
+        # Usually set from the shared backend, ie jelastic.account_limit
+        (module, attr) = value.split('.', 1)
+        return getattr(importlib.import_module(f'providers.common.{module}'), attr)
+    if value is True:
+        return getattr(load(provider), 'concurrency', default)
+    return value
+
+# Import the provider's module, once per process
+def load(provider):
+    with lock:
+        module = modules.get(provider)
+    if module is not None:
+        return module
+    get(provider)
+    module = importlib.import_module(f'providers.{provider}')
+    with lock:
+        return modules.setdefault(provider, module)
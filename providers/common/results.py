@@ -0,0 +1,51 @@
+import time
+from datetime import datetime
+
+from providers.base import CostItem
+from providers.common import store
+from providers.common.tokens import fingerprint
+
+# Cost results of recent runs, so running again shortly after (a retry, checking a failed account)
+# only queries the accounts that didn't succeed. Kept in the store under 'results'
+
+# Seconds a result is served from the cache, 0 never serves one
+ttl = 3600
+
+# Per provider overrides of ttl
+ttls = {}
+
+# Called from cloudcost.py with the [cache] config section
+# ttl is the default, any other key is a provider name and overrides it for that provider
+def configure(section):
+    global ttl
+    section = dict(section)
+    ttl = int(section.pop('ttl', ttl))
+    ttls.update({k: int(v) for (k, v) in section.items()})
+
+# Seconds results of provider stay fresh
+def max_age(provider) -> int:
+    return ttls.get(provider, ttl)
+
+# Credentials are part of the key so changing them never serves the old account's numbers
+def key(provider, name, cred) -> str:
+    return fingerprint(provider, [name, cred])
+
+# Returns (costs, pvms, fetched, latency) if we have a result no older than max_age seconds
+def get(provider, name, cred, max_age):
+    if max_age <= 0:
+        return None
+    stored = store.get('results', key(provider, name, cred))
+    if not stored:
+        return None
+    fetched = datetime.fromisoformat(stored['fetched'])
+    if time.time() - fetched.timestamp() > max_age:
+        return None
+    return [CostItem(*c) for c in stored['costs']], stored['pvms'], fetched, stored['latency']
+
+def put(provider, name, cred, costs, pvms, fetched, latency):
+    store.put('results', key(provider, name, cred), {
+        'costs': [list(c) for c in costs],
+        'pvms': pvms,
+        'fetched': fetched.isoformat(),
+        'latency': latency,
+    })
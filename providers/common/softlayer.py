@@ -1,7 +1,11 @@
-import requests
 import json
+import asyncio
+import hashlib
 
 from providers.base import CostItem
+from providers.common import aio
+from providers.common import ahttpclient
+from providers.common import archive
 
 # THE SOFTLAYER API ALSO RETURNS IBM BLUEMIX ITEMS WHY IBM FUCKING SEPARATE YOUR PRODUCTS
 # I take this back, apparently IBM's own API doesn't report costs for bluemix correctly
@@ -26,121 +30,165 @@ api_getInvoiceTopLevel = 'https://api.softlayer.com/rest/v3.1/SoftLayer_Billing_
 # Grab an invoices non-zero cost children
 api_getInvoiceChildren = 'https://api.softlayer.com/rest/v3.1/SoftLayer_Billing_Invoice_Item/{id}/getNonZeroAssociatedChildren.json'
 
-# Returns a CostItem representing the next billing cycle's expected costs
-def NextBilling(filter, account_name, api_key) -> CostItem:
-    # Uses basic auth? lol
-    auth = (account_name, api_key)
-
-    # We filter everything that doesn't start with paas
-    # Object filters suck https://sldn.softlayer.com/article/object-filters/
-    objectFilter = {
-        'nextInvoiceTopLevelBillingItems': {
-            'categoryCode' : {'operation': filter}
-        }
-    }
+# Children are pulled nested in the top level call through an object mask, this turns
+# 1 + N requests into a single one. If that call fails (huge accounts can time out
+# server side) we fall back to fetching children per item, set False to always do that
+batch_children = True
 
-    # These are the parameters we'll pass to the request
-    # Include the object filter as a json dump, its neater to do it this way
-    # Object masks are better than filters https://sldn.softlayer.com/article/object-masks/
-    paramsTopLevel = {
-        'objectMask': 'mask[id,categoryCode,recurringFee,cycleStartDate,nextBillDate]',
-        'objectFilter': json.dumps(objectFilter)
-    }
+# Number of concurrent child requests on the per item fallback path
+child_workers = 8
 
-    x = requests.get(api_getNextInvoiceTopLevel, auth=auth, params=paramsTopLevel)
-    topLevel = json.loads(x.text)
+# Does a GET against the API, raises if the call failed
+# Counts requests per account in stats so the savings of the batched path are visible
+# Returns the parsed json response
+async def get(url, auth, stats, call, params=None):
+    stats['requests'] += 1
+    x = await ahttpclient.get(url, auth=auth, params=params)
+    js = json.loads(x.text)
     if not x.ok:
-        raise Exception(f'getNextInvoiceTopLevel Failed:\n{json.dumps(topLevel, indent=4)}')
-    
-    startDate = None
-    endDate = None
-    if topLevel:
-        startDate = topLevel[0]['cycleStartDate']
-        endDate = topLevel[0]['nextBillDate']
+        raise Exception(f'{call} Failed:\n{json.dumps(js, indent=4)}')
+    return js
+
+# Pull top level items with their non-zero children nested under key children
+# Falls back to a flat top level call and concurrent per item child calls
+# Returns a list of (item, children) tuples in the order the API returned them
+async def itemsWithChildren(url, call, params, children, api_children, auth, stats):
+    if batch_children:
+        nested = dict(params)
+        nested['objectMask'] = params['objectMask'][:-1] + f',{children}[recurringFee]]'
+        try:
+            topLevel = await get(url, auth, stats, call, params=nested)
+            return [(item, item.get(children, [])) for item in topLevel]
+        except Exception as err:
+            print(f'{call} with nested children failed, fetching children per item: {err}')
+
+    topLevel = await get(url, auth, stats, call, params=params)
 
     # Mask for calls to getChildren
     paramsChildren = {
         'objectMask': 'mask[recurringFee]'
     }
 
-    total = 0
+    sem = asyncio.Semaphore(child_workers)
+    async def fetch(item):
+        async with sem:
+            return await get(api_children.format(id=item['id']), auth, stats, 'getChildren', params=paramsChildren)
 
-    # Loop through every top level item and pull the cost for its children
-    for item in topLevel:
+    return list(zip(topLevel, await asyncio.gather(*(fetch(item) for item in topLevel))))
+
+# Sum the recurring fee of every item and its children
+def itemsTotal(items) -> float:
+    total = 0
+    for (item, children) in items:
         total += float(item['recurringFee'])
-        x = requests.get(api_getChildren.format(id=item['id']), auth=auth, params=paramsChildren)
-        children = json.loads(x.text)
-        if not x.ok:
-            raise Exception(f'getChildren Failed:\n{json.dumps(children, indent=4)}')
         for child in children:
             total += float(child['recurringFee'])
+    return total
+
+# Check a categoryCode against one of the object filter operations we use
+# '^=paas' is starts with paas, '!^=paas' is doesn't start with paas
+def matches(filter, categoryCode) -> bool:
+    negate = filter.startswith('!')
+    op = filter.lstrip('!')
+    if op.startswith('^='):
+        match = (categoryCode or '').startswith(op[2:])
+    else:
+        match = categoryCode == op
+    return match != negate
+
+# Pull the unfiltered next invoice items and their children
+async def nextInvoice(auth, stats) -> list:
+    # Object masks are better than filters https://sldn.softlayer.com/article/object-masks/
+    paramsTopLevel = {
+        'objectMask': 'mask[id,categoryCode,recurringFee,cycleStartDate,nextBillDate]',
+    }
 
-    return CostItem(total, startDate, endDate)
+    return await itemsWithChildren(api_getNextInvoiceTopLevel, 'getNextInvoiceTopLevel', paramsTopLevel,
+                             'nonZeroNextInvoiceChildren', api_getChildren, auth, stats)
 
-# Return a CostItem representing the previous billing cycle
-def PrevBilling(filter, account_name, api_key) -> CostItem:
-    # Uses basic auth
-    auth = (account_name, api_key)
-    
-    # We filter everything that doesn't start with paas
-    # Object filters suck https://sldn.softlayer.com/article/object-filters/
-    objectFilter = {
-        'invoiceTopLevelItems': {
-            'categoryCode' : {'operation': filter}
-        }
-    }
-    
-    # These are the parameters we'll pass to the request
-    # Include the object filter as a json dump, its neater to do it this way
-    # Object masks are better than filters https://sldn.softlayer.com/article/object-masks/
+# Pull the previous invoice and its unfiltered items and their children
+# Returns None if there is no previous invoice
+async def prevInvoice(auth, stats):
     paramsTopLevel = {
         'objectMask': 'mask[id,categoryCode,recurringFee,billingItemId]',
-        'objectFilter': json.dumps(objectFilter)
     }
-    
+
     # Grab the previous invoice
-    x = requests.get(api_getPrevInvoice, auth=auth)
-    js = json.loads(x.text)
-    if not x.ok:
-        raise Exception(f'getPrevInvoice Failed:\n{json.dumps(js, indent=4)}')
+    js = await get(api_getPrevInvoice, auth, stats, 'getPrevInvoice')
     # Bluemix/softlayer return an empty response if there isn't one
     if not js:
         return None
-    # Need id and invoice creation date (billing period end date)
-    invoice = js['id']
-    endDate = js['createDate']
+
+    # Pull top level items for that invoice, once in its lifetime since it's closed
+    async def download():
+        items = await itemsWithChildren(api_getInvoiceTopLevel.format(id=js['id']), 'getInvoiceTopLevel', paramsTopLevel,
+                                  'nonZeroAssociatedChildren', api_getInvoiceChildren, auth, stats)
+        return json.dumps(items).encode('utf-8')
+
+    items = json.loads(await archive.afetch('softlayer', auth[0], js['id'], download))
+    return js, items
+
+# The softlayer and bluemix providers both read the same account, just filtered differently
+# So pull the unfiltered invoices once per credential per run and filter client side
+# Keyed by account name and a hash of the api key, each entry has its own lock so
+# concurrent callers for the same credential wait on a single fetch. Only touched on aio's loop
+invoices_cache = {}
+
+# Returns {'next': [(item, children)], 'prev': (invoice, [(item, children)]) or None}
+async def invoices(account_name, api_key) -> dict:
+    key = (account_name, hashlib.sha256(api_key.encode()).hexdigest())
+    if key not in invoices_cache:
+        invoices_cache[key] = {'lock': asyncio.Lock(), 'invoices': None}
+    entry = invoices_cache[key]
+
+    async with entry['lock']:
+        # Nothing stored if a previous attempt failed, so we just try again
+        if entry['invoices'] is None:
+            # Uses basic auth? lol
+            auth = (account_name, api_key)
+            stats = {'requests': 0}
+            (prev, nxt) = await asyncio.gather(prevInvoice(auth, stats), nextInvoice(auth, stats))
+            entry['invoices'] = {
+                'prev': prev,
+                'next': nxt,
+            }
+            print(f'softlayer {account_name} made {stats["requests"]} requests')
+        return entry['invoices']
+
+# Returns a CostItem representing the next billing cycle's expected costs
+async def NextBilling(filter, account_name, api_key) -> CostItem:
+    items = [i for i in (await invoices(account_name, api_key))['next'] if matches(filter, i[0]['categoryCode'])]
     
-    # Pull top level items for that invoice
-    x = requests.get(api_getInvoiceTopLevel.format(id=invoice), auth=auth, params=paramsTopLevel)
-    topLevel = json.loads(x.text)
-    if not x.ok:
-        raise Exception(f'getInvoiceTopLevel Failed:\n{json.dumps(topLevel, indent=4)}')
+    startDate = None
+    endDate = None
+    if items:
+        startDate = items[0][0]['cycleStartDate']
+        endDate = items[0][0]['nextBillDate']
 
-    # Mask for calls to getChildren
-    paramsChildren = {
-        'objectMask': 'mask[recurringFee]'
-    }
+    return CostItem(itemsTotal(items), startDate, endDate)
 
-    total = 0
-    # Loop through every top level item and pull the cost for its children
-    for item in topLevel:
-        total += float(item['recurringFee'])
-        x = requests.get(api_getInvoiceChildren.format(id=item['id']), auth=auth, params=paramsChildren)
-        children = json.loads(x.text)
-        if not x.ok:
-            raise Exception(f'getChildren Failed:\n{json.dumps(children, indent=4)}')
-        for child in children:
-            total += float(child['recurringFee'])
+# Return a CostItem representing the previous billing cycle
+async def PrevBilling(filter, account_name, api_key) -> CostItem:
+    prev = (await invoices(account_name, api_key))['prev']
+    if prev is None:
+        return None
 
-    return CostItem(total, "", endDate)
+    # Need invoice creation date (billing period end date)
+    (invoice, items) = prev
+    items = [i for i in items if matches(filter, i[0]['categoryCode'])]
+
+    return CostItem(itemsTotal(items), "", invoice['createDate'])
 
 # Do the cost thing
 # Filter should be either '^=paas' or '!^=paas'
 def cost(filter, account_name, api_key) -> "list[CostItem]":
-    prev = PrevBilling(filter, account_name, api_key)
+    return aio.run(acost(filter, account_name, api_key))
+
+async def acost(filter, account_name, api_key) -> "list[CostItem]":
+    prev = await PrevBilling(filter, account_name, api_key)
     ret = [
-        NextBilling(filter, account_name, api_key),
+        await NextBilling(filter, account_name, api_key),
     ]
     if prev:
         ret.append(prev)
-    return ret
\ No newline at end of file
+    return ret
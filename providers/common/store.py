@@ -0,0 +1,76 @@
+import json
+import os
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+
+from providers.common import db
+
+# Small persistent key/value store for state providers keep between runs
+# Values are anything json serializable, grouped by namespace (usually the provider)
+# Stored on disk as one json file per key under path, override with the
+# CLOUDCOST_STATE environment variable or configure()
+# Alternatively stored in the store table in postgres (see schema.sql)
+path = Path(os.environ.get('CLOUDCOST_STATE', Path.home() / '.cache' / 'cloudcost'))
+
+# 'disk' or 'postgres'
+backend = 'disk'
+
+lock = threading.Lock()
+
+# Point the store somewhere else, called from cloudcost.py with the [store] config section
+def configure(section):
+    global path, backend
+    if 'path' in section:
+        path = Path(section['path'])
+    backend = section.get('backend', backend)
+    if backend not in ('disk', 'postgres'):
+        raise Exception(f'Unknown store backend {backend}')
+
+# Keys can be anything (credentials included) so hash them
+def digest(key) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def location(namespace, key) -> Path:
+    return path / namespace / f"{digest(key)}.json"
+
+# Returns the stored value or default if we've never stored one
+def get(namespace, key, default=None):
+    if backend == 'postgres':
+        rows = db.execute('select value from store where namespace = %s and key = %s;', (namespace, digest(key)))
+        return rows[0][0] if rows else default
+
+    try:
+        with open(location(namespace, key)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return default
+
+# Store value, on disk its written to a temp file and swapped in so a crash never leaves half a file
+def put(namespace, key, value):
+    if backend == 'postgres':
+        db.execute('''insert into store (namespace, key, value) values (%s, %s, %s)
+                   on conflict (namespace, key) do update set value = excluded.value, updated = now();''',
+                (namespace, digest(key), json.dumps(value)))
+        return
+
+    file = location(namespace, key)
+    with lock:
+        file.parent.mkdir(parents=True, exist_ok=True)
+        # mkstemp creates the file readable by us only, some of what we store is sensitive
+        (fd, tmp) = tempfile.mkstemp(dir=file.parent, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp, file)
+
+# Forget a stored value
+def delete(namespace, key):
+    if backend == 'postgres':
+        db.execute('delete from store where namespace = %s and key = %s;', (namespace, digest(key)))
+        return
+
+    try:
+        location(namespace, key).unlink()
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,84 @@
+import json
+import time
+import hashlib
+import threading
+
+from providers.common import store
+
+# Auth token cache for providers that trade credentials for a token
+# Tokens are kept in memory for the run, and optionally in the store so later runs reuse them
+
+# Refresh tokens this many seconds before they actually expire
+margin = 300
+
+# Keep tokens in the store between runs, off by default since tokens are credentials
+persist = False
+
+cache = {}
+lock = threading.Lock()
+
+# Called from cloudcost.py with the [tokens] config section
+def configure(section):
+    global margin, persist
+    margin = int(section.get('margin', margin))
+    persist = str(section.get('persist', persist)).lower() in ('1', 'true', 'yes', 'on')
+
+# Never keep credentials around in the clear, key on a hash of them
+def fingerprint(provider, credential) -> str:
+    return f'{provider}/' + hashlib.sha256(json.dumps(credential).encode()).hexdigest()
+
+# Every credential has its own entry and lock so concurrent callers wait on one auth
+def entry(provider, credential) -> dict:
+    key = fingerprint(provider, credential)
+    with lock:
+        return cache.setdefault(key, {'key': key, 'lock': threading.Lock(), 'alock': None, 'token': None, 'expires': 0})
+
+# Returns a token for credential (a tuple of whatever identifies it), only calling fetch()
+# if we don't have one that's good for at least another margin seconds
+# fetch must return (token, expiry as a unix timestamp)
+def get(provider, credential, fetch) -> str:
+    e = entry(provider, credential)
+    with e['lock']:
+        if e['token'] is None and persist:
+            stored = store.get('tokens', e['key'])
+            if stored:
+                e['token'] = stored['token']
+                e['expires'] = stored['expires']
+
+        if e['token'] is None or e['expires'] - margin < time.time():
+            (e['token'], e['expires']) = fetch()
+            if persist:
+                store.put('tokens', e['key'], {'token': e['token'], 'expires': e['expires']})
+
+        return e['token']
+
+# get() for async providers, fetch is an async function returning (token, expiry)
+# Callers wait on an asyncio lock so one waiting on another's auth doesn't hold up the loop
+async def aget(provider, credential, fetch) -> str:
+    import asyncio
+    e = entry(provider, credential)
+    # Only ever touched on aio's loop, so no race creating it
+    if e['alock'] is None:
+        e['alock'] = asyncio.Lock()
+    async with e['alock']:
+        if e['token'] is None and persist:
+            stored = await asyncio.to_thread(store.get, 'tokens', e['key'])
+            if stored:
+                e['token'] = stored['token']
+                e['expires'] = stored['expires']
+
+        if e['token'] is None or e['expires'] - margin < time.time():
+            (e['token'], e['expires']) = await fetch()
+            if persist:
+                await asyncio.to_thread(store.put, 'tokens', e['key'], {'token': e['token'], 'expires': e['expires']})
+
+        return e['token']
+
+# Drop a token the provider rejected so the next get() authenticates again
+def invalidate(provider, credential):
+    e = entry(provider, credential)
+    with e['lock']:
+        e['token'] = None
+        e['expires'] = 0
+        if persist:
+            store.delete('tokens', e['key'])
@@ -1,9 +1,9 @@
-import requests
 import json
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
 from providers.base import CostItem
+from providers.common import httpclient
 
 # API endpoint
 endpoint = "https://api.digitalocean.com/v2/customers/my/balance"
@@ -16,7 +16,7 @@ def cost(account_name, api_key) -> "list[CostItem]":
 		'Content-Type':'application/json'
 	}
 
-	resp = requests.get(endpoint, headers=headers)
+	resp = httpclient.get(endpoint, headers=headers)
 	if not resp.ok:
 		raise Exception(f'API Call Failed\n{json.dumps(resp.json(),indent=4)}')
  
@@ -1,8 +1,10 @@
-import requests
 import json
 from datetime import datetime
 
 from providers.base import CostItem
+from providers.common import httpclient
+from providers.common import store
+from providers.common import archive
 
 def cost(account_name, api_key) -> "list[CostItem]":
 
@@ -16,12 +18,25 @@ def cost(account_name, api_key) -> "list[CostItem]":
     # The month we're looking for
     month = datetime.today().strftime('%Y-%m')
 
+    # Heroku only lists every invoice at once, closed ones included
+    # So keep the last list archived under its ETag and only download it again when it changed
+    etag = store.get('heroku', account_name)
+    cached = archive.get('heroku', account_name, etag) if etag else None
+    if cached is not None:
+        headers['If-None-Match'] = etag
+
     # We need to loop through all of Heroku's invoices and find the one
     # that is for our current month
-    x = requests.get(api_url, headers=headers)
-    js = json.loads(x.text)
-    if not x.ok:
-        raise Exception(f'API call failed:\n{json.dumps(js,indent=4)}')
+    x = httpclient.get(api_url, headers=headers)
+    if x.status_code == 304:
+        js = json.loads(cached)
+    else:
+        js = json.loads(x.text)
+        if not x.ok:
+            raise Exception(f'API call failed:\n{json.dumps(js,indent=4)}')
+        if x.headers.get('ETag'):
+            archive.put('heroku', account_name, x.headers['ETag'], x.content)
+            store.put('heroku', account_name, x.headers['ETag'])
     for i in js:
         if month in i['period_start']:
             # For some damn reason heroku returns this * 100
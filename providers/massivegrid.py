@@ -3,5 +3,11 @@ from providers.common import jelastic
 
 endpoint = "https://app.paas.massivegrid.com"
 
+# Accounts on this host run at once, their requests wait on jelastic.host_limit slots
+concurrency = jelastic.account_limit
+
 def cost(account_name, api_key) -> "list[CostItem]":
-    return jelastic.cost(endpoint, 'USD', account_name, api_key)
\ No newline at end of file
+    return jelastic.cost(endpoint, 'USD', account_name, api_key)
+
+async def acost(account_name, api_key) -> "list[CostItem]":
+    return await jelastic.acost(endpoint, 'USD', account_name, api_key)
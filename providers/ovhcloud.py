@@ -7,8 +7,20 @@ import ovh
 
 if __name__ != '__main__':
     from providers.base import CostItem
+    from providers.common import store
+    from providers.common import archive
+    from providers.common.pool import pmap
 else:
     from base import CostItem
+    from common import store
+    from common import archive
+    from common.pool import pmap
+
+# Number of bills we pull at once
+bill_workers = 8
+
+# How far back to look for the latest bill before we have anything cached
+recent_months = 2
 
 def cost(account_name, endpoint, app_key, app_secret, consumer_key):
     first_day = datetime.today().replace(day=1,hour=0,minute=0,second=0,microsecond=0).isoformat()
@@ -46,17 +58,40 @@ def cost(account_name, endpoint, app_key, app_secret, consumer_key):
     
     # OVH will return this in a bloody RANDOM order
     # and has no endpoint for the latest bill
-    # loop through all of them and compare the dates
-    bills = client.get('/me/bill')
+    # Bills never change once issued so keep what we've seen between runs
+    # and only pull bills we haven't seen before
+    key = f'{endpoint}/{account_name}'
+    seen = store.get('ovhcloud', key, {})
+
+    # Nothing issued before the newest bill we know of can be the latest, so ask only for those
+    # Without a cache try the last couple of months before listing every bill
+    if seen:
+        since = max(seen.values(), key=lambda b: datetime.fromisoformat(b['date']))['date']
+        bills = client.get('/me/bill', **{'date.from': since})
+    else:
+        recent = (datetime.today()-relativedelta(months=recent_months)).strftime('%Y-%m-%d')
+        bills = client.get('/me/bill', **{'date.from': recent}) or client.get('/me/bill')
     
     if bills is None:
         raise Exception(f'/me/bill failed')
+
+    # Pull anything new concurrently, we only need the date and price
+    # The bills themselves are archived so losing the state above never means pulling every bill again
+    def fetch_bill(billid) -> dict:
+        return json.loads(archive.fetch('ovhcloud', key, billid,
+                                        lambda: json.dumps(client.get(f'/me/bill/{billid}')).encode('utf-8')))
+
+    new = [billid for billid in bills if billid not in seen]
+    for (billid, bill) in zip(new, pmap(fetch_bill, new, bill_workers)):
+        seen[billid] = {'date': bill['date'], 'priceWithTax': bill['priceWithTax']}
+    if new:
+        store.put('ovhcloud', key, seen)
     
+    # loop through all of them and compare the dates
     prevBilling = None
     billDate = None
     
-    for billid in bills:
-        bill = client.get(f'/me/bill/{billid}')
+    for bill in seen.values():
         ptime = datetime.fromisoformat(bill['date'])
         if billDate is None or ptime > billDate:
             billDate = ptime
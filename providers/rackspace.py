@@ -1,10 +1,14 @@
 import json
-import requests
 import csv
 import codecs
 from datetime import datetime
+from dateutil.parser import isoparse
 
 from providers.base import CostItem
+from providers.common import aio
+from providers.common import ahttpclient
+from providers.common import tokens
+from providers.common import archive
 
 # API Endpoints
 auth_endpoint = "https://identity.api.rackspacecloud.com/v2.0/tokens"
@@ -13,9 +17,9 @@ latest_invoice_endpoint = "https://billing.api.rackspacecloud.com/v2/accounts/{r
 billing_summary = "https://billing.api.rackspacecloud.com/v2/accounts/{ran}/billing-summary"
 invoice_detail_endpoint = "https://billing.api.rackspacecloud.com/v2/accounts/{ran}/invoices/{invoiceId}/detail"
 
-# Do the cost thing
-def cost(account_name, api_key, billing_number) -> "list[CostItem]":
-    # Need to authenticate
+# Trade our api key for a token
+# Returns the token and its expiry as a unix timestamp
+async def authenticate(account_name, api_key):
     headers = {
         'Content-Type':'application/json'
     }
@@ -31,24 +35,43 @@ def cost(account_name, api_key, billing_number) -> "list[CostItem]":
     }
 
     # Do the auth
-    x = requests.post(auth_endpoint, headers = headers, json = data)
+    x = await ahttpclient.post(auth_endpoint, headers = headers, json = data)
     js = json.loads(x.text)
     if not x.ok:
         raise Exception(f'auth failure:\n{json.dumps(js,indent=4)}')
-    token = js['access']['token']['id']
+    token = js['access']['token']
+    return token['id'], isoparse(token['expires']).timestamp()
+
+# cost() and life() run back to back on the first of the cycle, only auth once
+async def token(account_name, api_key) -> str:
+    return await tokens.aget('rackspace', (account_name, api_key), lambda: authenticate(account_name, api_key))
+
+# Raise for a failed call, dropping our token if it was rejected
+def check(x, account_name, api_key, message):
+    if x.status_code == 401:
+        tokens.invalidate('rackspace', (account_name, api_key))
+    if not x.ok:
+        raise Exception(message)
+
+# Do the cost thing
+def cost(account_name, api_key, billing_number) -> "list[CostItem]":
+    return aio.run(acost(account_name, api_key, billing_number))
+
+async def acost(account_name, api_key, billing_number) -> "list[CostItem]":
+    # Need to authenticate
+    token_id = await token(account_name, api_key)
 
     # Form the request for estimated charges
     headers = {
         'Accept':'application/json',
-        'X-Auth-Token':token
+        'X-Auth-Token':token_id
     }
 
     # URL contains a parameter, format it and do the thing
     url = billing_endpoint.format(ran=billing_number)
-    x = requests.get(url, headers= headers)
+    x = await ahttpclient.get(url, headers= headers)
     js = json.loads(x.text)
-    if not x.ok:
-        raise Exception(f'estimated_charges failed:\n{json.dumps(js,indent=4)}')
+    check(x, account_name, api_key, f'estimated_charges failed:\n{json.dumps(js,indent=4)}')
 
     # This should result in estimated total for the current billing cycle
     ret = [
@@ -61,36 +84,20 @@ def cost(account_name, api_key, billing_number) -> "list[CostItem]":
     return ret
 
 def life(account_name, api_key, billing_number) -> "dict":
-    # Need to authenticate
-    headers = {
-        'Content-Type':'application/json'
-    }
+    return aio.run(alife(account_name, api_key, billing_number))
 
-    # Post data, build json object
-    data = json.dumps({
-        'auth': {
-            'RAX-KSKEY:apiKeyCredentials' : {
-                'username': account_name,
-                'apiKey': api_key
-            }
-        }
-    })
-    # Do the auth
-    x = requests.post(auth_endpoint, headers = headers, data = data)
-    if not x.ok:
-        raise Exception(f'auth failure: {x.text}')
-    js = json.loads(x.text)
-    token = js['access']['token']['id']
+async def alife(account_name, api_key, billing_number) -> "dict":
+    # Need to authenticate
+    token_id = await token(account_name, api_key)
 
     # Form the request for our latest invoice
     headers = {
         'Accept':'application/json',
-        'X-Auth-Token':token
+        'X-Auth-Token':token_id
     }
 
-    x = requests.get(latest_invoice_endpoint.format(ran=billing_number), headers = headers)
-    if not x.ok:
-        raise Exception(f'unable to get latest invoice: {x.text}')
+    x = await ahttpclient.get(latest_invoice_endpoint.format(ran=billing_number), headers = headers)
+    check(x, account_name, api_key, f'unable to get latest invoice: {x.text}')
     if x.status_code == 204:
         raise Exception(f'Latest invoice not available')
     js = json.loads(x.text)
@@ -98,14 +105,18 @@ def life(account_name, api_key, billing_number) -> "dict":
 
     # our next request returns text/csv
     headers['Accept'] = 'text/csv'
-    
-    x = requests.get(invoice_detail_endpoint.format(ran=billing_number, invoiceId=invoiceId), headers=headers)
-    if not x.ok:
-        raise Exception(f'failed to get detailed report {x}')
+
+    # The invoice is closed, so its detail only ever needs downloading once
+    async def download():
+        x = await ahttpclient.get(invoice_detail_endpoint.format(ran=billing_number, invoiceId=invoiceId), headers=headers)
+        check(x, account_name, api_key, f'failed to get detailed report {x}')
+        return x.content
+
+    detail = await archive.afetch('rackspace', billing_number, invoiceId, download)
 
     # We need to parse the csv
     # Create an iterator that will decode each line as text
-    detail_iter = codecs.iterdecode(x.iter_lines(), 'utf-8')
+    detail_iter = codecs.iterdecode(detail.splitlines(), 'utf-8')
     reader = csv.DictReader(detail_iter, delimiter=',')
     
     vms = {}
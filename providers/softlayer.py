@@ -4,4 +4,7 @@ from providers.common import softlayer
 # Do the cost thing
 def cost(account_name, api_key) -> "list[CostItem]":
     # Grab the cost of all items that begin with paas
-    return softlayer.cost('!^=paas', account_name, api_key)
\ No newline at end of file
+    return softlayer.cost('!^=paas', account_name, api_key)
+
+async def acost(account_name, api_key) -> "list[CostItem]":
+    return await softlayer.acost('!^=paas', account_name, api_key)
@@ -0,0 +1,89 @@
+import csv
+import json
+from datetime import datetime
+
+# Cost report writers, rows are written as accounts report in rather than held until the end
+# Every format takes the same rows, pick one with open_report()
+
+# Column headers, in order
+headers = ['Provider', 'Billing Start', 'Billing End', 'Account Name', 'Current Invoice', 'Balance']
+
+# Keys of the same columns in json lines
+keys = ['provider', 'start', 'end', 'account', 'cost', 'balance']
+
+# Returns the values of a report row for a CostItem of an account
+def row(provider, name, cost) -> list:
+    return [
+        provider,
+        # Split the string, if it contains more than a date, we only want the date
+        cost.startDate[:10] if cost.startDate else '',
+        cost.endDate[:10] if cost.endDate else '',
+        name,
+        round(float(cost.cost), 2),
+        cost.balance,
+    ]
+
+# Excel, written in openpyxl's write-only mode so rows go straight to disk
+# Same layout as always, report date on the first row and headers on the third
+class XlsxReport:
+    def __init__(self, fname):
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        self.fname = fname
+        self.cell = WriteOnlyCell
+        self.wb = Workbook(write_only=True)
+        self.ws = self.wb.create_sheet("Cloud Cost")
+
+        # Reporting dates
+        made = self.cell(self.ws, value=datetime.today())
+        made.number_format = 'yyyy-mm-dd'
+        self.ws.append(['Report Made:', made])
+        self.ws.append([])
+
+        # Headers
+        self.ws.append(headers)
+
+    def write(self, values):
+        # Costs are numbers, just shown with two decimals
+        cost = self.cell(self.ws, value=values[4])
+        cost.number_format = '0.00'
+        self.ws.append(values[:4] + [cost] + values[5:])
+
+    def close(self):
+        self.wb.save(self.fname)
+
+class CsvReport:
+    def __init__(self, fname):
+        self.fname = fname
+        self.file = open(fname, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(headers)
+
+    def write(self, values):
+        self.writer.writerow(values)
+
+    def close(self):
+        self.file.close()
+
+class JsonlReport:
+    def __init__(self, fname):
+        self.fname = fname
+        self.file = open(fname, 'w')
+
+    def write(self, values):
+        self.file.write(json.dumps(dict(zip(keys, values))) + '\n')
+
+    def close(self):
+        self.file.close()
+
+formats = {
+    'xlsx': XlsxReport,
+    'csv': CsvReport,
+    'jsonl': JsonlReport,
+}
+
+# Start a report in format, saved to fname once closed
+def open_report(format, fname):
+    if format not in formats:
+        raise Exception(f'Unknown report format {format}')
+    return formats[format](fname)
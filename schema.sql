@@ -14,6 +14,52 @@ create table if not exists accounts(
     constraint iaas_fk foreign key(iaas_id) references iaas(id)
 );
 
+-- State providers keep between runs when the store backend is postgres
+-- key is a sha256 of the actual key since keys can contain credentials
+create table if not exists store(
+    namespace text,
+    key text,
+    value jsonb,
+    updated timestamptz not null default now(),
+    primary key(namespace, key)
+);
+
+-- Currency rates against the EUR (ECB reference rates) when [rates] persist is on
+create table if not exists currency_rates(
+    date date,
+    currency text,
+    rate double precision,
+    primary key(date, currency)
+);
+
+-- Every cost item of every run, partitioned by the month it was fetched
+-- latency is how long the provider took to answer for the account, in seconds
+create table if not exists cost_snapshots(
+    provider text not null,
+    account text not null,
+    period_start date,
+    period_end date,
+    cost numeric(14, 2),
+    balance text,
+    fetched_at timestamptz not null,
+    latency double precision
+) partition by range (fetched_at);
+
+-- Catches anything a monthly partition wasn't created for
+create table if not exists cost_snapshots_default partition of cost_snapshots default;
+
+create index if not exists cost_snapshots_account on cost_snapshots(provider, account, fetched_at);
+create index if not exists cost_snapshots_period on cost_snapshots(period_start);
+
+-- Where the time of each run went when [metrics] persist is on, see providers/common/metrics.py
+create table if not exists runs(
+    id serial primary key,
+    command text,
+    started timestamptz,
+    finished timestamptz,
+    summary jsonb
+);
+
 create or replace function create_iaas(
     iaas_var text
 ) returns void as $$
@@ -22,6 +68,20 @@ begin
 end;
 $$ language plpgsql;
 
+-- Create the cost_snapshots partition for the month of month_var if it doesn't exist yet
+-- The bounds are midnight UTC, as cloudcost.py picks the month from the UTC fetched_at, whatever the server's TimeZone
+create or replace function create_snapshot_partition(
+    month_var date
+) returns void as $$
+declare
+start_var date := date_trunc('month', month_var);
+begin
+    execute format('create table if not exists %I partition of cost_snapshots for values from (%L) to (%L);',
+        'cost_snapshots_' || to_char(start_var, 'YYYY_MM'),
+        start_var::timestamp at time zone 'UTC', (start_var + interval '1 month')::timestamp at time zone 'UTC');
+end;
+$$ language plpgsql;
+
 create or replace function get_iaas() returns text[] as $$
 begin
     return array(
@@ -9,7 +9,7 @@ python3 -m pip install pip -U
 python3 -m venv venv
 source ./venv/bin/activate
 # Grab required python dependencies
-python3 -m pip install install psycopg2-binary python-dateutil openpyxl ovh
+python3 -m pip install install psycopg2-binary python-dateutil openpyxl ovh CurrencyConverter aiohttp
 # Generate our DB password
 db_pass=$(< /dev/urandom tr -dc _A-Z-a-z-0-9 | head -c${1:-32})
 # Generate our config file
@@ -26,6 +26,10 @@ database = cloudcost
 server = 
 channel_id = 
 token = 
+
+[concurrency]
+workers = 8
+per_provider = 4
 EOF
 # Create database user, and assign previleges
 sudo -u postgres `psql -d postgres -c "create user cloudcost with createdb password '$db_pass';"`